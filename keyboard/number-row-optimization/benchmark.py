@@ -0,0 +1,263 @@
+"""
+Measures how fast the parts of num_row_optimizer.py that checking all
+permutations depends on are, e.g. before and after changing one of them:
+
+    python benchmark.py --save baseline.json
+    (change something)
+    python benchmark.py --compare baseline.json
+
+Every result is a throughput (calls, layouts or permutations per second), the
+median of several runs. With --compare, it fails if any of them is more
+than --threshold slower than in the baseline.
+
+How fast a shared or throttled machine is can change by a factor of two
+within a minute, so before and after each run the same plain Python code is
+timed too. The comparisons use the throughput relative to it.
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import time
+
+from num_row_optimizer import (SWEEP_ENGINES, Config, Optimizer, TopK,
+                               ParetoFrontier)
+
+try:
+    import numpy as np
+except ImportError:  # only needed for the numpy benchmarks
+    np = None
+
+# Needs at least Python 3.8
+
+# keys -> configuration of the row, for the sweeps
+ROWS = {
+    8: Config(current='1234 5678',
+              left_keys_position_rating=[0.55, 0.8, 1, 0.98]),
+    9: Config(current='1234 56789',
+              left_keys_position_rating=[0.55, 0.8, 1, 0.98],
+              right_keys_position_rating=[0.7, 0.99, 1, 0.8, 0.5]),
+    10: Config(),
+}
+
+# for how many keys each engine checks all permutations by default (the loop
+# engine takes about a minute for 10 keys)
+SWEEP_KEYS = {'loop': [8, 9], 'swaps': [8, 9, 10], 'numpy': [8, 9, 10]}
+
+# How often each benchmark is run, and how long each run takes at least. The
+# median of the runs counts.
+REPEATS = 20
+SWEEP_REPEATS = 3
+MIN_SECONDS = 0.1
+
+# how many steps the plain Python code timed before and after each run takes
+# (about a hundredth of a second)
+REFERENCE_STEPS = 10 ** 5
+
+# how many layouts the benchmarks of single calls go through
+CALLS = 20000
+
+# the default for --threshold
+REGRESSION_THRESHOLD = 0.2
+
+
+def reference():
+    # plain Python code that no change to the optimizer makes faster
+    total = 0
+    for i in range(REFERENCE_STEPS):
+        total += i % 7
+    return total
+
+
+def throughput(function, n, repeats=REPEATS, min_seconds=MIN_SECONDS):
+    """
+    Returns how many things function does per second and per run of
+    reference if it does n of them per call, as the median of repeats runs.
+    Like with timeit, each run calls it twice as often as the one before
+    until it takes at least min_seconds.
+    """
+    def timed(function, calls=1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        return (time.perf_counter() - start) / calls
+
+    def run(calls):
+        before = timed(reference)
+        seconds = timed(function, calls)
+        return seconds, 2 * seconds / (before + timed(reference))
+
+    calls = 1
+    runs = [run(calls)]
+    while runs[0][0] * calls < min_seconds:
+        calls *= 2
+        runs = [run(calls)]
+
+    runs += [run(calls) for _ in range(repeats - 1)]
+    seconds, relative_seconds = zip(*runs)
+    return (n / statistics.median(seconds),
+            n / statistics.median(relative_seconds))
+
+
+def random_layouts(optimizer, count, seed=0):
+    rng = random.Random(seed)
+    keys = list(range(len(optimizer.keys)))
+    layouts = []
+    for _ in range(count):
+        rng.shuffle(keys)
+        layouts.append(bytes(keys))
+    return layouts
+
+
+def benchmark_calls(optimizer):
+    # name -> (calls per second, calls per run of reference)
+    layouts = random_layouts(optimizer, CALLS)
+    rng = random.Random(1)
+    scores = [rng.random() for _ in layouts]
+
+    def score():
+        for layout in layouts:
+            optimizer.score(layout)
+
+    def count_swaps():
+        for layout in layouts:
+            optimizer.count_swaps(layout)
+
+    def get_swaps():
+        for layout in layouts:
+            optimizer.get_swaps(layout)
+
+    def steadiness_score():
+        for layout in layouts:
+            optimizer.steadiness_score(layout)
+
+    def top_k():
+        top = TopK(10)
+        for layout, rating in zip(layouts, scores):
+            top.add(layout, rating)
+
+    def frontier():
+        frontier = ParetoFrontier()
+        rng = random.Random(2)
+        for layout, rating in zip(layouts, scores):
+            frontier.add(layout, rating, rng.randrange(10), rng.random())
+
+    results = {}
+    for function in (score, count_swaps, get_swaps, steadiness_score, top_k,
+                     frontier):
+        results[f'{function.__name__} calls'] = throughput(function, CALLS)
+
+    optimizer.build_side_tables()
+    results['score with side tables calls'] = throughput(score, CALLS)
+
+    if np is not None:
+        block = np.array([list(layout) for layout in layouts],
+                         dtype=np.uint8)
+        for method in (optimizer.rate_block, optimizer.count_swaps_block,
+                       optimizer.get_swaps_block, optimizer.steadiness_block):
+            results[f'{method.__name__} layouts'] = \
+                throughput(lambda: method(block), CALLS)
+    return results
+
+
+def benchmark_sweeps(engines, keys=None):
+    # name -> (permutations per second, permutations per run of reference),
+    # for SWEEP_KEYS by default
+    results = {}
+    for engine in engines:
+        if engine == 'numpy' and np is None:
+            continue
+
+        for n_keys in SWEEP_KEYS[engine] if keys is None else keys:
+            optimizer = Optimizer(ROWS[n_keys])
+            results[f'{engine} sweep of {n_keys} keys permutations'] = \
+                throughput(lambda: optimizer.sweep(engine),
+                           math.factorial(n_keys), SWEEP_REPEATS)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints how each result compares to the baseline, relative to the speed of
+    reference, and returns the names of the ones that are more than threshold
+    slower.
+    """
+    regressions = []
+    width = max(len(name) for name in results)
+    print(f"{'':<{width}}  {'per second':>14}  change\n")
+    for name, (per_second, relative) in results.items():
+        if name not in baseline:
+            print(f"{name:<{width}}  {per_second:>14,.0f}  "
+                  f"(not in the baseline)")
+            continue
+
+        change = relative / baseline[name]['relative'] - 1
+        note = ''
+        if change < -threshold:
+            regressions.append(name)
+            note = '  REGRESSION'
+        print(f"{name:<{width}}  {per_second:>14,.0f}  "
+              f"{100 * change:+6.1f}%{note}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description="Measures how fast rating layouts and checking all "
+                        "permutations are.")
+    parser.add_argument(
+            '--engines', nargs='+', choices=SWEEP_ENGINES,
+            default=list(SWEEP_ENGINES),
+            help="which engines to check all permutations with (default: "
+                 "all)")
+    parser.add_argument(
+            '--keys', nargs='+', type=int, choices=sorted(ROWS),
+            help="for how many keys to check all permutations (default: 8 "
+                 "and 9 for the loop engine, 8, 9 and 10 for the others)")
+    parser.add_argument(
+            '--save', metavar='FILE',
+            help="write the results to FILE as JSON, e.g. as a baseline")
+    parser.add_argument(
+            '--compare', metavar='FILE',
+            help="compare the results with the ones in FILE and fail if any "
+                 "of them is more than the threshold slower")
+    parser.add_argument(
+            '--threshold', type=float, default=REGRESSION_THRESHOLD,
+            help=f"how much slower counts as a regression (default: "
+                 f"{REGRESSION_THRESHOLD}, i.e. "
+                 f"{100 * REGRESSION_THRESHOLD:g}%%)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    results = benchmark_calls(Optimizer(ROWS[10]))
+    results.update(benchmark_sweeps(args.engines, args.keys))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+    else:
+        regressions = compare(results, {}, args.threshold)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': {name: {'per_second': per_second,
+                                          'relative': relative}
+                                   for name, (per_second, relative)
+                                   in results.items()}}, f, indent=1)
+
+    if regressions:
+        sys.exit(f"\n{len(regressions)} of the results are more than "
+                 f"{100 * args.threshold:g}% slower than in {args.compare}")
+
+
+if __name__ == '__main__':
+    main()
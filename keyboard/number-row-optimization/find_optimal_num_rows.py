@@ -1,10 +1,23 @@
+import argparse
+import ast
+import json
 import math
+import os
 import sys
-from itertools import permutations
-from string import digits
+from itertools import product
 
+from num_row_optimizer import (Config, Constraints, Optimizer,
+                               RankIndex, RatingTable, SweepProgress,
+                               check_all_parameter_sets,
+                               rate_block_for_parameter_sets)
 
-# Needs at least Python 3.5
+try:
+    import numpy as np
+except ImportError:  # needed for SWEEP_ENGINE = 'numpy' and some options
+    np = None
+
+
+# Needs at least Python 3.8
 
 
 # Tracks how comfortable and quick each key is to press (from pinky to the two
@@ -30,10 +43,6 @@ IMBALANCE_PENALTY_FACTOR = 0.38
 # Zipfian and the real world distribution using this value.
 ZIPF_FACTOR = 0.6
 
-# frequency for zero from real world data (wiki + gutenberg)
-# If this was 0.5 it would imply half of all digits are zero.
-RW_0_FREQ = 0.134418127182388
-
 # I'd recommend against enabling this, as Wikipedia and Gutenberg both are
 # biased by, among others, how much data there is for certain years (1800-1999)
 # Similarly, I'd not set the ZIPF_FACTOR to below 0.4 if you program regularly.
@@ -41,6 +50,18 @@ USE_REAL_WORLD_AVERAGE = False
 
 CURRENT = '12345 67890'
 
+# If CURRENT contains keys other than digits (e.g. '-' and '=' for a row of 12
+# keys), add how often they are used here, relative to the zipfian digit
+# frequencies below (1 is 0.5, 2 is 0.33, 3 is 0.25 and so on). Both position
+# ratings need one value per key on their side.
+OTHER_KEY_FREQUENCY = {}
+
+# Rates with fixed point numbers (see FIXED_POINT_BITS in num_row_optimizer.py)
+# instead of plain floats. The ratings are very slightly less precise, but
+# layouts that should have the same rating always do, instead of depending on
+# the order in which floats were added up.
+FIXED_POINT = False
+
 # @formatter:off
 MANUAL_DIGIT_PERMUTATIONS = [
     # reverse left half and move 0 to before 6
@@ -60,6 +81,44 @@ MANUAL_DIGIT_PERMUTATIONS = [
 
 CHECK_ALL_PERMUTATIONS = True
 
+# How to check all permutations. 'loop' rates them one by one, 'swaps' goes
+# through them by swapping two keys at a time and only updates the ratings,
+# which is a few times faster. 'numpy' rates them in large blocks and takes
+# seconds instead of minutes (needs numpy). All give the same results.
+SWEEP_ENGINE = 'loop'
+
+# How many processes check all permutations. 0 uses one for every CPU.
+WORKERS = 1
+
+# How often (in seconds) to show how many permutations were checked so far
+# while checking all of them, on stderr. None shows nothing.
+PROGRESS_INTERVAL = 10
+
+# The results of checking all permutations are kept here, so running the
+# script again with the same parameters is instant. Once the results take up
+# more than CACHE_MAX_SIZE bytes, the least recently used ones are removed.
+# Set to None to always check all permutations. The tables of all ratings
+# for --table are kept here too (58 MB for 10 keys), but never removed.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                         'number-row-optimization')
+CACHE_MAX_SIZE = 10 * 1024 * 1024
+
+# Instead of checking all permutations, the best permutations can also be
+# found by checking every way of splitting the keys into a left and right side.
+# The imbalance penalty only depends on the sides, and each side is best when
+# the most frequent keys are on the best positions. This gives the same best
+# permutations within a second, even for rows with 12 or 13 keys.
+USE_SIDE_SPLIT_SOLVER = False
+
+# Compare the side split solver with checking all permutations (slow).
+VERIFY_SIDE_SPLIT_SOLVER = False
+
+# Another way to get the same best permutations without checking all of them:
+# place the keys one position at a time and give up on a partial layout once
+# the rest can't make it better than the best ones so far. Also takes less
+# than a second for rows with 12 to 14 keys.
+USE_BRANCH_AND_BOUND = False
+
 BEST_PERMUTATIONS_COUNT = 10
 
 # to find the best arrangement with at most this many swaps
@@ -69,123 +128,28 @@ NUM_FMT = '.2f'
 
 # -----------------------------------------------------------------------------
 
-LEFT = CURRENT[:5]
-RIGHT = CURRENT[6:]
-
-
-def normalize_both(items_1, items_2, target_sum=1):
-    s = (sum(items_1) + sum(items_2)) / target_sum
-    divide_all_by(items_1, s)
-    divide_all_by(items_2, s)
-
-
-def divide_all_by(items, s):
-    for n in range(len(items)):
-        items[n] = items[n] / s
-
-
-def normalize_dict_values(mapping, target_sum=1):
-    s = sum(mapping.values()) / target_sum
-
-    for k, v in mapping.items():
-        mapping[k] = v / s
-
-
-digit_frequency = {d: 1 / (n + 1) for n, d in enumerate(digits)}
-
-print()
-print(f'\nzipf digit frequency: {digit_frequency}')
-
-if USE_REAL_WORLD_AVERAGE:
-    # linux c files
-    code_digit_frequency = {  #
-        '9': 0.02909295446151662, '7': 0.034580576202551956,
-        '5': 0.04585847891973208, '6': 0.05364252590529784,
-        '8': 0.058946164959403545, '4': 0.06311291445004744,
-        '3': 0.07513337383312362, '2': 0.12266975307381336,
-        '1': 0.13828881215531044, '0': 0.3786744460392031}
-
-    # assume zipf = digit frequencies in code
-    code_digit_frequency = digit_frequency
-
-    # 1/2 gutenberg, 1/2 wikipedia
-    digit_frequency = {  #
-        '0': 0.13441812718238821, '1': 0.2199522594323372,
-        '2': 0.1185139034025656, '3': 0.0761447147048975,
-        '4': 0.0690145404114608, '5': 0.07157156795805049,
-        '6': 0.06450709962180562, '7': 0.06354688650306475,
-        '8': 0.07996884100271787, '9': 0.10236205978071194}
-
-    for d, f in digit_frequency.items():
-        cf = code_digit_frequency[d]
-        digit_frequency[d] = ZIPF_FACTOR * cf + (1 - ZIPF_FACTOR) * f
-else:
-    d0 = digit_frequency['0']
-    digit_frequency['0'] = ZIPF_FACTOR * d0 + (1 - ZIPF_FACTOR) * RW_0_FREQ
-
-print(f'\nused digit frequency: {digit_frequency}')
-
-normalize_dict_values(digit_frequency)
-
-print(f'\nused digit frequency (normalized): {digit_frequency}')
-
-# We normalize to a total of 200 to make things easier to read
-normalize_both(LEFT_KEYS_POSITION_RATING, RIGHT_KEYS_POSITION_RATING, 200)
-
-dfs = sorted(digit_frequency.values())
-max_frequency_delta_between_sides = sum(dfs[5:]) / 5 - sum(dfs[:5]) / 5
-
-
-class RatingResult:
-    def __init__(self, left, right, total, imbalance_penalty):
-        self.left = left
-        self.right = right
-        self.total = total
-        self.imbalance_penalty = imbalance_penalty
-
-
-def rating_per_side_and_total(perm):
-    left, right = rating_per_side(perm)
-    total = left + right
-
-    laf, raf = average_frequency_per_side(perm)
-    norm_frequency_delta = abs(laf - raf) / max_frequency_delta_between_sides
-    imbalance_penalty = total * norm_frequency_delta * IMBALANCE_PENALTY_FACTOR
-    total -= imbalance_penalty
-
-    return RatingResult(left, right, total, imbalance_penalty)
-
-
-def average_frequency_per_side(perm):
-    left, right = perm.split()
-    return average_frequency_of_side(left), average_frequency_of_side(right)
-
-
-def average_frequency_of_side(perm):
-    return sum(digit_frequency[d] for d in perm) / 5
-
+def configured_optimizer():
+    right_keys_position_rating = RIGHT_KEYS_POSITION_RATING
+    if RIGHT_KEYS_POSITION_RATING == LEFT_KEYS_POSITION_RATING[::-1]:
+        # keeps them mirrored for other left ratings with --grid
+        right_keys_position_rating = None
 
-def rating_per_side(perm):
-    left, right = perm.split()
+    return Optimizer(Config(
+            current=CURRENT,
+            left_keys_position_rating=LEFT_KEYS_POSITION_RATING,
+            right_keys_position_rating=right_keys_position_rating,
+            imbalance_penalty_factor=IMBALANCE_PENALTY_FACTOR,
+            zipf_factor=ZIPF_FACTOR,
+            use_real_world_average=USE_REAL_WORLD_AVERAGE,
+            other_key_frequency=OTHER_KEY_FREQUENCY,
+            fixed_point=FIXED_POINT))
 
-    left_rating = rating_for_one_side(left, LEFT_KEYS_POSITION_RATING)
-    right_rating = rating_for_one_side(right, RIGHT_KEYS_POSITION_RATING)
 
-    return left_rating, right_rating
+def print_perm_with_rating(optimizer, layout, fmt=NUM_FMT):
+    result = optimizer.score(layout)
 
-
-def rating_for_one_side(perm, rating):
-    # depends on how often a digit appears and in which key position
-    return sum(rating[pos] * digit_frequency[d] for pos, d in enumerate(perm))
-
-
-current_rating = rating_per_side_and_total(CURRENT).total
-
-
-def print_perm_with_rating(perm, fmt=NUM_FMT):
-    result = rating_per_side_and_total(perm)
-
-    improvement_percentage = 100 * ((result.total / current_rating) - 1)
+    improvement_percentage = 100 * ((result.total /
+                                      optimizer.current_rating) - 1)
     increase = ''
     if improvement_percentage != 0:
         increase = f'{improvement_percentage:+{fmt}}%'
@@ -195,8 +159,8 @@ def print_perm_with_rating(perm, fmt=NUM_FMT):
     total_text = f"{result.total:{fmt}}"
     imbalance_penalty_text = f"{result.imbalance_penalty:.5f}"
 
-    print_columns(perm, imbalance_penalty_text, left_text, right_text,
-                  total_text, increase)
+    print_columns(optimizer.layout_str(layout), imbalance_penalty_text,
+                  left_text, right_text, total_text, increase)
 
 
 def print_columns(perm, imbalance_penalty, left, right, total, change):
@@ -224,186 +188,576 @@ def print_header(text, is_current=False):
     print()
 
 
-def get_swaps(a, target=CURRENT):
-    len_target = len(target)
-    if len(a) != len_target:
-        raise ValueError("both arguments must have the same length")
-
-    char_to_current_index = {c: n for n, c in enumerate(target)}
-    swaps = []
-    n = 0
-    arr = list(a)
-    while n < len_target - 1:
-        cn = char_to_current_index[arr[n]]
-        if cn == n:
-            n += 1
-        else:
-            arr[cn], arr[n] = arr[n], arr[cn]
-            swaps.append((target[n], target[cn]))
-    return swaps
-
-
-def count_swaps(arrangement, target=CURRENT):
-    """
-    >>> current = "12345 67890"
-    >>> count_swaps(current, current)
-    0
-    >>> count_swaps("54321 67890", current)
-    2
-    >>> count_swaps("67890 12345", current)
-    5
-    >>> count_swaps("42315 60897", current)
-    2
-    >>> count_swaps("12345 60897", current)
-    1
-    >>> count_swaps("12345 60987", current)
-    2
-    >>> count_swaps("23145 67890", current)
-    2
-    >>> count_swaps("82315 67094", current)  # 1 with 4, 0 with 8, 8 with 4
-    3
-    """
-    len_current = len(target)
-    if len(arrangement) != len_current:
-        raise ValueError("both arguments must have the same length")
-
-    char_to_current_index = {c: n for n, c in enumerate(target)}
-
-    swaps = 0
-    n = 0
-    arr = list(arrangement)
-    while n < len_current - 1:
-        cn = char_to_current_index[arr[n]]
-        if cn == n:
-            n += 1
-        else:
-            swaps += 1
-            # move current character to it's target place
-            arr[cn], arr[n] = arr[n], arr[cn]
-
-    return swaps
-
-
-def update_to_mirror_if_rating_equal_and_steadier(permutations_with_rating):
-    for i, (p, p_rating) in enumerate(permutations_with_rating):
-        p_mirrored = p[::-1]
-        p_mirrored_rating = rating_per_side_and_total(p_mirrored).total
-
-        if math.isclose(p_rating, p_mirrored_rating):
-            # mirrored version with same rating exists
-            p_score = steadiness_score(p)
-            p_mirrored_score = steadiness_score(p_mirrored)
-
-            if p_score < p_mirrored_score:
-                permutations_with_rating[i] = (p_mirrored, p_mirrored_rating)
-
-
-def steadiness_score(perm):
-    """
-    Returns a score that depends on how many digits stay on their current side
-    and how many digits stay in the same position (easier to learn if more).
-    """
-    # -1 to account for the space
-    exact_same_position_count = -1
-
-    for pc, cc in zip(perm, CURRENT):
-        if pc == cc:
-            exact_same_position_count += 1
-
-    # it's more important that frequent digits stay on the same side
-    same_side_score = sum(digit_frequency[pc] for pc in perm[:5] if pc in LEFT)
-    same_side_score += sum(
-            digit_frequency[pc] for pc in perm[6:] if pc in RIGHT)
-
-    return exact_same_position_count + same_side_score * 2
-
-
-# -----------------------------------------------------------------------------
-
-print_header("Current layout", is_current=True)
-print_perm_with_rating(CURRENT)
-
-print_header("Entered permutations")
-cur_characters = set(CURRENT)
-for ds in MANUAL_DIGIT_PERMUTATIONS:
-    if set(ds) != cur_characters:
-        raise ValueError(f"{ds} contains different, less or more characters "
-                         f"than CURRENT")
-    print_perm_with_rating(ds)
-
-if not CHECK_ALL_PERMUTATIONS:
-    sys.exit()
-
-best_permutations = [('', 0) for _ in range(BEST_PERMUTATIONS_COUNT)]
-
-best_keep_sides_perm = None
-best_keep_sides_perm_rating = 0
+def print_best_within_swaps(optimizer, max_swaps, target=None, count=1,
+                            constraints=None):
+    if target is None or target == optimizer.current_layout:
+        print_header(f"Best with at most {max_swaps} swaps")
+    else:
+        print_header(f"Best with at most {max_swaps} swaps from "
+                     f"{optimizer.layout_str(target)}")
+
+    best = optimizer.best_within_swaps(max_swaps, target, count, constraints)
+    for layout, _ in best:
+        print_perm_with_rating(optimizer, layout)
+
+    if len(best) == 1:
+        keys = optimizer.keys
+        swaps = [f'{keys[a]} with {keys[b]}'
+                 for a, b in optimizer.get_swaps(best[0][0], target)]
+        if len(swaps) > 1:
+            print(f"\n(swap {', '.join(swaps[:-1])} and {swaps[-1]})")
+        elif swaps:
+            print(f"\n(swap {swaps[0]})")
+
+
+def count_to_collect(count):
+    # A permutation and its mirrored version are only shown once. If the right
+    # side is rated like the mirrored left one, both are among the best, so
+    # twice as many are needed to show count of them.
+    return 2 * count
+
+
+def print_best_permutations(optimizer, permutations_with_rating,
+                            count=BEST_PERMUTATIONS_COUNT):
+    permutations_with_rating = list(permutations_with_rating)
+    optimizer.update_to_mirror_if_rating_equal_and_steadier(
+            permutations_with_rating)
+
+    # a permutation and its mirrored version often both are among the best,
+    # but we only want to show it once
+    printed = set()
+    for p, _ in permutations_with_rating:
+        if p not in printed and len(printed) < count:
+            printed.add(p)
+            print_perm_with_rating(optimizer, p)
+
+
+def print_anytime_search(optimizer, budget):
+    # The gap is how much better the best layout could be at most. Layouts
+    # are shown as they are found, not only once the time is over.
+    text = f"Better and better layouts within {budget:g} seconds"
+    print(f"\n\n{text}\n{'-' * len(text)}")
+    print(f"{'seconds':>7}    arrangement{'total':>8}{'gap':>10}\n")
+
+    best = None
+    for layout, result, gap, seconds in optimizer.anytime_search(budget):
+        gap = '' if gap is None else f"{100 * gap:>9{NUM_FMT}}%"
+        print(f"{seconds:>7.3f}    {optimizer.layout_str(layout)}"
+              f"{result.total:>8{NUM_FMT}}{gap}", flush=True)
+        best = layout
+
+    print_header(f"Best found within {budget:g} seconds")
+    print_perm_with_rating(optimizer, best)
+
+
+# the parameters that can be changed for each parameter set in a grid
+GRID_PARAMETERS = ['ZIPF_FACTOR', 'IMBALANCE_PENALTY_FACTOR',
+                   'LEFT_KEYS_POSITION_RATING', 'RIGHT_KEYS_POSITION_RATING']
+
+
+def grid_optimizers(optimizer, grid):
+    # Returns every combination of the values in grid and an optimizer for
+    # each, with the configured values for the parameters that aren't in it.
+    names = list(grid)
+    parameter_sets = [dict(zip(names, values))
+                      for values in product(*grid.values())]
+    optimizers = [Optimizer(optimizer.config.updated(
+                          **{name.lower(): value
+                             for name, value in parameters.items()}))
+                  for parameters in parameter_sets]
+    return parameter_sets, optimizers
+
+
+def print_parameter_sweep(optimizer, grid, count):
+    parameter_sets, optimizers = grid_optimizers(optimizer, grid)
+
+    print(f"\n\nChecking {len(optimizer.keys)}! permutations for "
+          f"{len(parameter_sets)} parameter sets.")
+
+    best = check_all_parameter_sets(optimizers, count_to_collect(count))
+
+    # Like print_best_permutations, show a permutation and its mirrored
+    # version only once, so that float rounding doesn't decide which of them
+    # wins for each parameter set.
+    for parameter_set_optimizer, items in zip(optimizers, best):
+        parameter_set_optimizer.update_to_mirror_if_rating_equal_and_steadier(
+                items)
+        unique = {}
+        for layout, rating in items:
+            unique.setdefault(layout, rating)
+        items[:] = list(unique.items())[:count]
+
+    for parameters, items in zip(parameter_sets, best):
+        text = ', '.join(f'{name} = {value}'
+                         for name, value in parameters.items())
+        print(f"\n\n{text}\n{'-' * len(text)}")
+        for layout, rating in items:
+            print(f"{optimizer.layout_str(layout)}{rating:>8{NUM_FMT}}")
+
+    # how each winner does with the other parameters, compared to their best
+    winners = sorted({items[0][0] for items in best})
+    ratings = rate_block_for_parameter_sets(
+            np.array([list(w) for w in winners], dtype=np.uint8), optimizers)
+    best_ratings = np.array([[items[0][1]] for items in best])
+    worst_share = (ratings / best_ratings).min(axis=0)
+    wins = [sum(items[0][0] == w for items in best) for w in winners]
+
+    text = "Winners across all parameter sets"
+    print(f"\n\n{text}\n{'-' * len(text)}")
+    print(f"arrangement{'wins':>8}    lowest share of the best rating\n")
+    for w, n_wins, share in sorted(zip(winners, wins, worst_share),
+                                   key=lambda item: (-item[1], -item[2])):
+        print(f"{optimizer.layout_str(w)}{n_wins:>8}    "
+              f"{100 * share:{NUM_FMT}}%")
 
-best_n_swaps_perm = None
-best_n_swaps_perm_rating = 0
 
-worst_perm = None
-worst_perm_rating = float("inf")
+def print_frontier(optimizer, frontier):
+    # Every layout here is the best one can get without more swaps and less
+    # steadiness. Those with higher ratings need more of one or the other.
+    text = "Trade-offs between rating, swaps and steadiness"
+    print(f"\n\n{text}\n{'-' * len(text)}")
+    print(f"arrangement{'swaps':>8}{'steadiness':>12}{'total':>8}"
+          f"    change from current\n")
+
+    for layout, _, swaps, steadiness in frontier.items():
+        # Like print_perm_with_rating, rate it again. When checking only half
+        # of the permutations, the mirrored ones get the rating of the other
+        # half, which might differ by float rounding.
+        rating = optimizer.score(layout).total
+        change = ''
+        improvement_percentage = 100 * ((rating /
+                                         optimizer.current_rating) - 1)
+        if improvement_percentage != 0:
+            change = f'    {improvement_percentage:+{NUM_FMT}}%'
+        print(f"{optimizer.layout_str(layout)}{swaps:>8}"
+              f"{steadiness:>12{NUM_FMT}}{rating:>8{NUM_FMT}}{change}")
+
+
+def print_distributions(stats):
+    text = "Distribution of the ratings"
+    print(f"\n\n{text}\n{'-' * len(text)}")
+    quantiles = ('0.01', '0.1', '0.5', '0.9', '0.99')
+    print(f"{'percentile':<10}" +
+          ''.join(f"{100 * float(q):>8g}" for q in quantiles) + "\n")
+    for name, distribution in stats['distributions'].items():
+        name = 'penalty' if name == 'imbalance_penalty' else name
+        print(f"{name:<10}" +
+              ''.join(f"{distribution['quantiles'][q]:>8{NUM_FMT}}"
+                      for q in quantiles))
 
-most_balanced_perm = None
-most_balanced_perm_rating = 0
-most_balanced_imbalance_penalty_factor = float("inf")
+    print()
+    n = stats['permutations']
+    for percent, count in stats['better_than_current_by'].items():
+        print(f"better than current by more than {percent:>3}: "
+              f"{count:>11,} ({100 * count / n:{NUM_FMT}}%)"
+              .replace(',', ' '))
 
-print("\n\nChecking 10! = 3 628 800 permutations. This will take a bit.\n\n")
 
-for p in permutations(digits):
-    p = ''.join(p[:5]) + ' ' + ''.join(p[5:])
+def print_sweep(optimizer, sweep):
+    # the results of checking all permutations
+    print_header("Worst permutation")
+    print_perm_with_rating(optimizer, sweep.worst.best())
 
-    result = rating_per_side_and_total(p)
-    rating = result.total
+    print_header("Best permutations")
+    print_best_permutations(optimizer, sweep.best.items())
 
-    if rating < worst_perm_rating:
-        worst_perm_rating = rating
-        worst_perm = p
+    print_header(f"Best of the most balanced")
+    print_perm_with_rating(optimizer, sweep.most_balanced.best())
 
-    if rating > best_n_swaps_perm_rating and count_swaps(p) <= MAX_N_SWAPS:
-        best_n_swaps_perm_rating = rating
-        best_n_swaps_perm = p
+    print_frontier(optimizer, sweep.frontier)
+    print_distributions(sweep.stats())
 
-    if rating > best_keep_sides_perm_rating and all(d in p[:5] for d in LEFT):
-        best_keep_sides_perm_rating = rating
-        best_keep_sides_perm = p
 
-    for i in range(BEST_PERMUTATIONS_COUNT):
-        cur = best_permutations[i]
+def cached_table_path(optimizer, suffix, build):
+    # builds the file in CACHE_DIR on first use
+    path = optimizer.table_path(CACHE_DIR, suffix)
+    if not os.path.exists(path):
+        print(f"\n\nRating all {len(optimizer.keys)}! permutations for "
+              f"{path}.")
+        build(path)
+    return path
 
-        if cur[1] < rating:
-            best_permutations[i] = (p, rating)
-            break
 
-    imbalance_penalty = result.imbalance_penalty
-    rating_without_imbalance_penalty = rating - imbalance_penalty
-    imbalance_penalty_factor = imbalance_penalty / rating
-    if imbalance_penalty_factor <= most_balanced_imbalance_penalty_factor:
-        # there will be many "most balanced" permutations with the same rating,
-        # since the imbalance penalty does not consider positions, only sides
-        if rating_without_imbalance_penalty > most_balanced_perm_rating:
-            most_balanced_imbalance_penalty_factor = imbalance_penalty_factor
-            most_balanced_perm = p
-            most_balanced_perm_rating = rating_without_imbalance_penalty
+def print_table_query(optimizer, constraints, count, worst):
+    table = RatingTable(optimizer, cached_table_path(
+            optimizer, '', optimizer.build_table))
 
-print_header("Worst permutation")
-print_perm_with_rating(worst_perm)
+    text = "Worst" if worst else "Best"
+    if constraints is not None:
+        text += " with constraints"
+    print_header(f"{text} (from the table)")
+    for layout, _ in table.top(count, constraints, worst):
+        print_perm_with_rating(optimizer, layout)
 
-print_header("Best permutations")
-update_to_mirror_if_rating_equal_and_steadier(best_permutations)
-for s, _ in best_permutations:
-    print_perm_with_rating(s)
 
-print_header("Best where digits stay on their current side")
-print_perm_with_rating(best_keep_sides_perm)
+def print_ranks(optimizer, layouts):
+    index = RankIndex(optimizer, cached_table_path(
+            optimizer, '-ranks', optimizer.build_rank_index))
 
-print_header(f"Best with at most {MAX_N_SWAPS} swaps")
-print_perm_with_rating(best_n_swaps_perm)
+    text = f"Rank among all {len(optimizer.keys)}! permutations"
+    print(f"\n\n{text}\n{'-' * len(text)}")
+    print(f"arrangement{'rank':>10}{'percentile':>12}{'total':>8}\n")
+
+    ranks = index.ranks(layouts)
+    percentiles = index.percentiles(layouts)
+    for layout, rank, percentile in zip(layouts, ranks, percentiles):
+        total = optimizer.score(layout).total
+        print(f"{optimizer.layout_str(layout)}{rank:>10}"
+              f"{percentile:>11{NUM_FMT}}%{total:>8{NUM_FMT}}")
+
+
+def check_all_permutations_with_engine(optimizer, start_rank=0,
+                                       end_rank=None):
+    if SWEEP_ENGINE == 'numpy' and np is None:
+        raise ImportError("SWEEP_ENGINE = 'numpy' requires numpy")
+
+    n_keys = len(optimizer.keys)
+    if end_rank is None:
+        end_rank = math.factorial(n_keys)
+    n_permutations = f"{math.factorial(n_keys):,}".replace(',', ' ')
+    if (start_rank, end_rank) == (0, math.factorial(n_keys)):
+        print(f"\n\nChecking {n_keys}! = {n_permutations} permutations. "
+              f"This will take a bit.\n\n")
+    else:
+        print(f"\n\nChecking the {n_keys}! = {n_permutations} permutations "
+              f"with a rank from {start_rank} up to {end_rank}.\n\n")
+
+    progress = None
+    if PROGRESS_INTERVAL is not None:
+        progress = SweepProgress(optimizer.n_checked(start_rank, end_rank),
+                                 PROGRESS_INTERVAL, report=print_progress)
+
+    sweep = optimizer.sweep(SWEEP_ENGINE, WORKERS,
+                            count_to_collect(BEST_PERMUTATIONS_COUNT),
+                            start_rank=start_rank, end_rank=end_rank,
+                            progress=progress)
+
+    if progress is not None:
+        print_progress(progress)
+        seconds = sum(progress.phases.values())
+        if seconds:
+            print("time per phase: " + ', '.join(
+                      f"{phase} {100 * phase_seconds / seconds:.0f}%"
+                      for phase, phase_seconds in progress.phases.items()),
+                  file=sys.stderr)
+    return sweep, progress
+
+
+def print_progress(progress):
+    print(progress, file=sys.stderr, flush=True)
+
+
+def merge_results(optimizer, paths):
+    sweep, ranges = optimizer.merge_partial_sweeps(paths)
+
+    print(f"\n\nMerged the results of {len(paths)} files.")
+    missing = []
+    rank = 0
+    n_permutations = math.factorial(len(optimizer.keys))
+    for start, end in ranges + [(n_permutations, n_permutations)]:
+        if start > rank:
+            missing.append(f"{rank} up to {start}")
+        rank = end
+    if missing:
+        print(f"The permutations with a rank from {', '.join(missing)} are "
+              f"missing.")
+    print("\n")
+
+    return sweep
+
+
+def check_layout_str(optimizer, ds):
+    if sorted(ds.replace(' ', '')) != optimizer.keys:
+        raise ValueError(f"{ds} contains different, less or more "
+                         f"characters than CURRENT")
+    return optimizer.to_layout(ds)
+
+
+def parse_args(optimizer):
+    def layout(text):
+        return check_layout_str(optimizer, text)
+
+    def key_positions(text):
+        return key_and_positions(optimizer, text)
+
+    parser = argparse.ArgumentParser(
+            description="Finds the best arrangements of the number row.")
+    parser.add_argument(
+            '--max-swaps', type=int, metavar='N',
+            help="only show the best layouts with at most N swaps")
+    parser.add_argument(
+            '--budget', type=float, metavar='SECONDS',
+            help="instead of checking all permutations, search for the best "
+                 "layout for SECONDS and show every better one as soon as it "
+                 "is found")
+    parser.add_argument(
+            '--from', dest='target', type=layout,
+            default=optimizer.current_layout, metavar='LAYOUT',
+            help="layout to count the swaps from, like '12345 67890' "
+                 "(default: CURRENT)")
+    parser.add_argument(
+            '--count', type=int, default=1,
+            help="how many layouts to show with --max-swaps or constraints "
+                 "(default: 1)")
+
+    # Constraints. Positions are counted from 0 on the far left.
+    parser.add_argument(
+            '--keep-sides', action='store_true',
+            help="only allow layouts where keys stay on their current side")
+    parser.add_argument(
+            '--pin', type=key_positions, action='append', default=[],
+            metavar='KEY:POSITION', help="only allow KEY on POSITION")
+    parser.add_argument(
+            '--forbid', type=key_positions, action='append', default=[],
+            metavar='KEY:POSITIONS',
+            help="never put KEY on any of POSITIONS (comma separated or "
+                 "'pinky')")
+    parser.add_argument(
+            '--max-hand-changes', type=int, metavar='N',
+            help="only allow layouts where at most N keys change sides")
+
+    parser.add_argument(
+            '--no-cache', action='store_true',
+            help="check all permutations again, even if there are results "
+                 "for the same parameters from an earlier run")
+    parser.add_argument(
+            '--start-rank', type=int, default=0, metavar='N',
+            help="only check the permutations from the one with rank N "
+                 "(counted from 0 in the order of itertools.permutations)")
+    parser.add_argument(
+            '--end-rank', type=int, metavar='N',
+            help="only check the permutations before the one with rank N")
+    parser.add_argument(
+            '--save-results', metavar='FILE',
+            help="write the results of checking the permutations to FILE, "
+                 "for --merge")
+    parser.add_argument(
+            '--merge', nargs='+', metavar='FILE',
+            help="show the merged results of --save-results runs for other "
+                 "ranks instead of checking the permutations")
+    parser.add_argument(
+            '--stats', metavar='FILE',
+            help="also write the distribution of the ratings of all "
+                 "permutations to FILE as JSON ('-' for stdout)")
+    parser.add_argument(
+            '--table', action='store_true',
+            help="answer from a table of the ratings of all permutations, "
+                 "which is built on first use (needs numpy). Shows the best "
+                 "--count layouts the constraints allow.")
+    parser.add_argument(
+            '--worst', action='store_true',
+            help="show the worst layouts instead, with --table")
+    parser.add_argument(
+            '--rank', type=layout, action='append', default=[],
+            metavar='LAYOUT',
+            help="show where LAYOUT falls among all permutations, using an "
+                 "index that is built on first use (needs numpy)")
+    parser.add_argument(
+            '--rank-file', metavar='FILE',
+            help="the same for every layout in FILE, one per line ('-' for "
+                 "stdin)")
+    parser.add_argument(
+            '--grid', type=grid_parameter, action='append', default=[],
+            metavar='NAME=VALUES',
+            help="find the best layouts for every combination of the given "
+                 "values instead, e.g. 'ZIPF_FACTOR=[0.4, 0.6, 0.8]' "
+                 "(needs numpy)")
+
+    args = parser.parse_args()
+
+    forbidden = {}
+    for key, positions in args.forbid:
+        forbidden.setdefault(key, set()).update(positions)
+
+    pinned = {}
+    for key, positions in args.pin:
+        if len(positions) != 1:
+            parser.error(f"--pin needs exactly one position for {key!r}")
+        pinned[key] = positions[0]
+
+    args.grid = dict(args.grid)
+
+    if args.rank_file is not None:
+        with open(args.rank_file if args.rank_file != '-' else 0) as f:
+            try:
+                args.rank += [layout(line.strip()) for line in f
+                              if line.strip()]
+            except ValueError as e:
+                parser.error(f"--rank-file: {e}")
+
+    if (args.table or args.rank) and CACHE_DIR is None:
+        parser.error("--table and --rank need a CACHE_DIR to keep the index "
+                     "in")
+    if args.worst and not args.table:
+        parser.error("--worst only works with --table")
+
+    n_permutations = math.factorial(len(optimizer.keys))
+    if args.end_rank is None:
+        args.end_rank = n_permutations
+    if not 0 <= args.start_rank <= args.end_rank <= n_permutations:
+        parser.error(f"ranks have to be between 0 and {n_permutations}")
+    args.whole_range = (args.start_rank, args.end_rank) == (0, n_permutations)
+    if args.merge and (not args.whole_range or args.save_results):
+        parser.error("--merge doesn't work with --start-rank, --end-rank "
+                     "and --save-results")
+
+    args.constraints = None
+    if (args.keep_sides or pinned or forbidden or
+            args.max_hand_changes is not None):
+        args.constraints = Constraints(args.keep_sides, pinned, forbidden,
+                                       args.max_hand_changes)
+
+    return args
+
+
+def grid_parameter(text):
+    # argparse only shows the message of an ArgumentTypeError, and doesn't
+    # catch the SyntaxError of literal_eval at all
+    name, _, values = text.partition('=')
+    if name not in GRID_PARAMETERS:
+        raise argparse.ArgumentTypeError(
+                f"{name} is not one of {', '.join(GRID_PARAMETERS)}")
+
+    try:
+        values = ast.literal_eval(values)
+    except (SyntaxError, ValueError):
+        raise argparse.ArgumentTypeError(
+                f"{values!r} is not a Python list") from None
+    if not isinstance(values, list):
+        raise argparse.ArgumentTypeError("values have to be a list")
+    return name, values
+
+
+def key_and_positions(optimizer, text):
+    key, _, positions = text.rpartition(':')
+    optimizer.key_index(key)
+
+    if positions == 'pinky':
+        return key, optimizer.pinky_positions
+
+    n_keys = len(optimizer.keys)
+    positions = tuple(int(pos) for pos in positions.split(','))
+    if not all(0 <= pos < n_keys for pos in positions):
+        raise ValueError(f"positions have to be between 0 and {n_keys - 1}")
+    return key, positions
+
+
+def main():
+    optimizer = configured_optimizer()
+
+    args = parse_args(optimizer)
+    if args.max_swaps is not None:
+        print_best_within_swaps(optimizer, args.max_swaps, args.target,
+                                args.count, args.constraints)
+        return
+
+    if args.budget is not None:
+        print_anytime_search(optimizer, args.budget)
+        return
+
+    if args.grid:
+        if np is None:
+            raise ImportError("--grid requires numpy")
+        print_parameter_sweep(optimizer, args.grid, args.count)
+        return
+
+    if args.rank:
+        if np is None:
+            raise ImportError("--rank requires numpy")
+        print_ranks(optimizer, args.rank)
+        return
+
+    if args.table:
+        if np is None:
+            raise ImportError("--table requires numpy")
+        print_table_query(optimizer, args.constraints, args.count, args.worst)
+        return
+
+    if args.constraints is not None:
+        print_header("Best with constraints")
+        for layout, _ in optimizer.best_feasible(args.constraints,
+                                                 args.count):
+            print_perm_with_rating(optimizer, layout)
+        return
 
-swaps = [f'{a} with {b}' for a, b in get_swaps(best_n_swaps_perm)]
+    print()
+    print(f'\nzipf digit frequency: {optimizer.zipf_digit_frequency}')
+    print(f'\nused digit frequency: {optimizer.used_digit_frequency}')
+    print(f'\nused digit frequency (normalized): '
+          f'{optimizer.digit_frequency}')
+
+    print_header("Current layout", is_current=True)
+    print_perm_with_rating(optimizer, optimizer.current_layout)
+
+    print_header("Entered permutations")
+    for ds in MANUAL_DIGIT_PERMUTATIONS:
+        print_perm_with_rating(optimizer, check_layout_str(optimizer, ds))
+
+    print_best_within_swaps(optimizer, MAX_N_SWAPS)
+
+    # only 5! * 5! layouts keep the sides, so this doesn't need to check all
+    print_header("Best where digits stay on their current side")
+    best_keeping_sides = optimizer.best_feasible(Constraints(keep_sides=True))
+    print_perm_with_rating(optimizer, best_keeping_sides[0][0])
+
+    if USE_SIDE_SPLIT_SOLVER:
+        print_header("Best permutations (side split solver)")
+        count = count_to_collect(BEST_PERMUTATIONS_COUNT)
+        side_split_best = optimizer.top_k(count)
+
+        if VERIFY_SIDE_SPLIT_SOLVER:
+            if side_split_best != \
+                    optimizer.best_permutations_by_checking_all(count):
+                raise AssertionError("side split solver disagrees with "
+                                     "checking all permutations")
+
+        print_best_permutations(optimizer, side_split_best)
+
+    if USE_BRANCH_AND_BOUND:
+        print_header("Best permutations (branch and bound)")
+        print_best_permutations(optimizer, optimizer.branch_and_bound(
+                count_to_collect(BEST_PERMUTATIONS_COUNT)))
+
+    if not CHECK_ALL_PERMUTATIONS:
+        return
+
+    # only the results for all permutations are cached
+    use_cache = CACHE_DIR is not None and not args.no_cache and \
+        args.whole_range
+    sweep = None
+    if args.merge:
+        sweep = merge_results(optimizer, args.merge)
+    elif use_cache and args.save_results is None:
+        sweep = optimizer.load_sweep(
+                CACHE_DIR, count_to_collect(BEST_PERMUTATIONS_COUNT))
+        if sweep is not None:
+            print("\n\nUsing the results of an earlier run with the same "
+                  "parameters.\n\n")
+
+    progress = None
+    if sweep is None:
+        sweep, progress = check_all_permutations_with_engine(
+                optimizer, args.start_rank, args.end_rank)
+        if use_cache:
+            optimizer.store_sweep(CACHE_DIR, sweep, CACHE_MAX_SIZE)
+        if args.save_results is not None:
+            optimizer.store_partial_sweep(args.save_results, sweep,
+                                          args.start_rank, args.end_rank)
+
+    print_sweep(optimizer, sweep)
+
+    if args.stats is not None:
+        stats = sweep.stats()
+        if progress is not None:
+            stats['progress'] = progress.stats()
+        if args.stats == '-':
+            print()
+            json.dump(stats, sys.stdout, indent=1)
+            print()
+        else:
+            with open(args.stats, 'w') as f:
+                json.dump(stats, f, indent=1)
 
-print(f"\n(swap {', '.join(swaps[:-1])} and {swaps[-1]})")
 
-print_header(f"Best of the most balanced")
-print_perm_with_rating(most_balanced_perm)
+if __name__ == '__main__':
+    main()
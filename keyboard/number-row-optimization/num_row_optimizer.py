@@ -0,0 +1,2830 @@
+"""
+Finds the best arrangements of the number row. find_optimal_num_rows.py is
+the command line interface for it.
+
+Importing this doesn't compute or print anything, and numpy is only imported
+once something needs it. Every Optimizer has its own configuration, so many
+of them can be used side by side.
+
+>>> optimizer = Optimizer(Config(imbalance_penalty_factor=0.38))
+>>> layout = optimizer.to_layout('12345 67890')
+>>> round(optimizer.score(layout).total, 2)
+16.33
+>>> [(optimizer.layout_str(p), round(rating, 2))
+...  for p, rating in optimizer.best_within_swaps(2)]
+[('17345 62098', 20.1)]
+"""
+import hashlib
+import json
+import math
+import os
+import random
+import socket
+import time
+from bisect import bisect_left, bisect_right, insort
+from functools import lru_cache, partial
+from heapq import heappop, heappush, heapreplace
+from itertools import combinations, permutations
+from string import digits
+
+# Needs at least Python 3.8
+
+# frequency for zero from real world data (wiki + gutenberg)
+# If this was 0.5 it would imply half of all digits are zero.
+RW_0_FREQ = 0.134418127182388
+
+# Relative difference up to which two ratings might only differ because the
+# floats were added in another order.
+RATING_TOLERANCE = 1e-9
+
+# With Config.fixed_point, frequencies and position ratings are rounded down
+# to multiples of 2 ** -FIXED_POINT_BITS. The ratings of each side are then
+# multiples of 2 ** -(2 * FIXED_POINT_BITS), small enough for floats to add
+# them up exactly in any order, and so is the imbalance penalty after rounding
+# it down. Ratings that are equal on paper are then always exactly equal.
+FIXED_POINT_BITS = 16
+
+# the columns of a RatingTable, in the order of RatingResult
+TABLE_COLUMNS = ('left', 'right', 'total', 'imbalance_penalty')
+
+# How many bins the histogram of each rating has when checking all
+# permutations, and the percentages by which we count how many are better
+# than current.
+DISTRIBUTION_BINS = 1000
+BETTER_THAN_CURRENT_BY = (0, 10, 20, 30)
+
+# the ways to check all permutations, see Optimizer.sweep
+SWEEP_ENGINES = ('loop', 'swaps', 'numpy')
+
+# How many permutations the loop engine checks before it updates the
+# SweepProgress.
+PROGRESS_BATCH = 4096
+
+
+class Config:
+    """
+    Everything the ratings depend on. See find_optimal_num_rows.py for what
+    each of them means. If right_keys_position_rating is None, the left ones
+    are mirrored.
+    """
+
+    def __init__(self, current='12345 67890',
+                 left_keys_position_rating=(0.55, 0.8, 1, 0.98, 0.72),
+                 right_keys_position_rating=None,
+                 imbalance_penalty_factor=0.38, zipf_factor=0.6,
+                 use_real_world_average=False, other_key_frequency=None,
+                 fixed_point=False):
+        self.current = current
+        self.left_keys_position_rating = tuple(left_keys_position_rating)
+        if right_keys_position_rating is not None:
+            right_keys_position_rating = tuple(right_keys_position_rating)
+        self.right_keys_position_rating = right_keys_position_rating
+        self.imbalance_penalty_factor = imbalance_penalty_factor
+        self.zipf_factor = zipf_factor
+        self.use_real_world_average = use_real_world_average
+        self.other_key_frequency = dict(other_key_frequency or {})
+        self.fixed_point = fixed_point
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={value!r}'
+                           for name, value in vars(self).items())
+        return f'Config({fields})'
+
+    def updated(self, **changes):
+        """
+        Returns a copy with some of the values changed.
+
+        >>> Config().updated(zipf_factor=0.8).zipf_factor
+        0.8
+        """
+        return Config(**{**vars(self), **changes})
+
+
+def normalize_both(items_1, items_2, target_sum=1):
+    s = (sum(items_1) + sum(items_2)) / target_sum
+    divide_all_by(items_1, s)
+    divide_all_by(items_2, s)
+
+
+def divide_all_by(items, s):
+    for n in range(len(items)):
+        items[n] = items[n] / s
+
+
+def normalize_dict_values(mapping, target_sum=1):
+    s = sum(mapping.values()) / target_sum
+
+    for k, v in mapping.items():
+        mapping[k] = v / s
+
+
+def to_fixed_point(value, bits=FIXED_POINT_BITS):
+    """
+    Rounds value (a float or numpy array) down to a multiple of 2 ** -bits.
+
+    >>> to_fixed_point(0.1)
+    0.0999908447265625
+    >>> to_fixed_point(0.1) * 2 ** FIXED_POINT_BITS
+    6553.0
+    """
+    scale = 2 ** bits
+    return value * scale // 1 / scale
+
+
+def position_ratings(left, right):
+    left, right = list(left), list(right)
+
+    # We normalize to a total of 200 to make things easier to read
+    normalize_both(left, right, 200)
+
+    return left, right
+
+
+class RatingResult:
+    def __init__(self, left, right, total, imbalance_penalty):
+        self.left = left
+        self.right = right
+        self.total = total
+        self.imbalance_penalty = imbalance_penalty
+
+
+class Optimizer:
+    """
+    Rates and searches the layouts for one Config.
+
+    Internally, layouts are bytes with the index of each key in self.keys,
+    left side first. Strings like '12345 67890' are only used for input and
+    printing.
+
+    Subclasses can rate sides in another way by overriding
+    rating_for_one_side. score, the loop engine and everything else built on
+    score use it. What depends on the rating being linear (the swaps and
+    numpy engines, mirrored sweeps, rate_block, top_k and branch_and_bound)
+    raises ValueError instead, mirror_symmetric is False and
+    rating_upper_bound returns None.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.current = config.current
+        self.left, self.right = config.current.split()
+        self.keys = sorted(self.left + self.right)
+
+        left_rating = config.left_keys_position_rating
+        right_rating = config.right_keys_position_rating
+        if right_rating is None:
+            right_rating = left_rating[::-1]
+
+        if len(self.left) != len(left_rating) or \
+                len(self.right) != len(right_rating):
+            raise ValueError("each side of current needs as many keys as "
+                             "there are position ratings for it")
+
+        (self.zipf_digit_frequency, self.used_digit_frequency,
+         self.digit_frequency) = self.key_frequency()
+
+        if set(self.digit_frequency) != set(self.keys):
+            raise ValueError("other_key_frequency needs a frequency for every "
+                             "key in current that is not a digit")
+
+        self.left_keys_position_rating, self.right_keys_position_rating = \
+            position_ratings(left_rating, right_rating)
+        self.imbalance_penalty_factor = config.imbalance_penalty_factor
+
+        self.fixed_point = config.fixed_point
+        if self.fixed_point:
+            self.digit_frequency = {k: to_fixed_point(f)
+                                    for k, f in self.digit_frequency.items()}
+            self.left_keys_position_rating = [
+                    to_fixed_point(r) for r in self.left_keys_position_rating]
+            self.right_keys_position_rating = [
+                    to_fixed_point(r)
+                    for r in self.right_keys_position_rating]
+
+        self.max_frequency_delta_between_sides = self.max_frequency_delta(
+                self.digit_frequency.values())
+
+        self.n_left = len(self.left)
+        self.frequency = [self.digit_frequency[k] for k in self.keys]
+        self.is_left_key = [k in self.left for k in self.keys]
+
+        self.current_layout = self.to_layout(self.current)
+
+        # where each key is in current
+        self.current_position = [self.current_layout.index(k)
+                                 for k in range(len(self.keys))]
+
+        # Positions are counted from 0 on the far left, across both sides.
+        self.pinky_positions = (0, len(self.keys) - 1)
+
+        # see build_side_tables
+        self._side_tables = None
+
+        self.current_rating = self.score(self.current_layout).total
+
+        # If the right side is rated like the mirrored left side, every layout
+        # is rated the same as its mirrored version (up to float rounding), so
+        # checking all permutations only needs to rate half of them. A
+        # subclass might rate the far left key of each side differently.
+        self.mirror_symmetric = (
+                self.has_linear_side_rating() and
+                len(self.left) == len(self.right) and
+                self.right_keys_position_rating ==
+                self.left_keys_position_rating[::-1])
+
+        # (left side, right side) -> frequency delta
+        self._side_split_frequency_delta = {}
+
+    def key_frequency(self):
+        """
+        Returns the zipfian digit frequencies and the frequencies of the keys
+        in current, before and after normalizing them.
+        """
+        zipf_factor = self.config.zipf_factor
+        digit_frequency = {d: 1 / (n + 1) for n, d in enumerate(digits)}
+        zipf_digit_frequency = dict(digit_frequency)
+
+        if self.config.use_real_world_average:
+            # linux c files
+            code_digit_frequency = {  #
+                '9': 0.02909295446151662, '7': 0.034580576202551956,
+                '5': 0.04585847891973208, '6': 0.05364252590529784,
+                '8': 0.058946164959403545, '4': 0.06311291445004744,
+                '3': 0.07513337383312362, '2': 0.12266975307381336,
+                '1': 0.13828881215531044, '0': 0.3786744460392031}
+
+            # assume zipf = digit frequencies in code
+            code_digit_frequency = digit_frequency
+
+            # 1/2 gutenberg, 1/2 wikipedia
+            digit_frequency = {  #
+                '0': 0.13441812718238821, '1': 0.2199522594323372,
+                '2': 0.1185139034025656, '3': 0.0761447147048975,
+                '4': 0.0690145404114608, '5': 0.07157156795805049,
+                '6': 0.06450709962180562, '7': 0.06354688650306475,
+                '8': 0.07996884100271787, '9': 0.10236205978071194}
+
+            for d, f in digit_frequency.items():
+                cf = code_digit_frequency[d]
+                digit_frequency[d] = zipf_factor * cf + (1 - zipf_factor) * f
+        else:
+            d0 = digit_frequency['0']
+            digit_frequency['0'] = \
+                zipf_factor * d0 + (1 - zipf_factor) * RW_0_FREQ
+
+        digit_frequency = {d: f for d, f in digit_frequency.items()
+                           if d in self.keys}
+        digit_frequency.update(self.config.other_key_frequency)
+
+        used_digit_frequency = dict(digit_frequency)
+
+        normalize_dict_values(digit_frequency)
+
+        return zipf_digit_frequency, used_digit_frequency, digit_frequency
+
+    def max_frequency_delta(self, frequencies):
+        dfs = sorted(frequencies)
+        n_left, n_right = len(self.left), len(self.right)
+        return max(
+            sum(dfs[-n_left:]) / n_left - sum(dfs[:n_right]) / n_right,
+            sum(dfs[-n_right:]) / n_right - sum(dfs[:n_left]) / n_left)
+
+    def to_layout(self, perm):
+        return bytes(self.keys.index(k) for k in perm.replace(' ', ''))
+
+    def layout_str(self, layout):
+        """
+        >>> optimizer = Optimizer(Config())
+        >>> optimizer.layout_str(optimizer.to_layout('12345 67890'))
+        '12345 67890'
+        """
+        return (''.join(self.keys[k] for k in layout[:self.n_left]) + ' ' +
+                ''.join(self.keys[k] for k in layout[self.n_left:]))
+
+    def score(self, layout):
+        if self._side_tables is None:
+            left, right = self.rating_per_side(layout)
+            laf, raf = self.average_frequency_per_side(layout)
+        else:
+            left_table, right_table = self._side_tables
+            left, laf = left_table[layout[:self.n_left]]
+            right, raf = right_table[layout[self.n_left:]]
+        total = left + right
+
+        norm_frequency_delta = \
+            abs(laf - raf) / self.max_frequency_delta_between_sides
+        imbalance_penalty = \
+            total * norm_frequency_delta * self.imbalance_penalty_factor
+        if self.fixed_point:
+            imbalance_penalty = to_fixed_point(imbalance_penalty,
+                                               2 * FIXED_POINT_BITS)
+        total -= imbalance_penalty
+
+        return RatingResult(left, right, total, imbalance_penalty)
+
+    def average_frequency_per_side(self, layout):
+        return (self.average_frequency_of_side(layout[:self.n_left]),
+                self.average_frequency_of_side(layout[self.n_left:]))
+
+    def average_frequency_of_side(self, side):
+        return sum(self.frequency[k] for k in side) / len(side)
+
+    def rating_per_side(self, layout):
+        left_rating = self.rating_for_one_side(
+                layout[:self.n_left], self.left_keys_position_rating)
+        right_rating = self.rating_for_one_side(
+                layout[self.n_left:], self.right_keys_position_rating)
+
+        return left_rating, right_rating
+
+    def rating_for_one_side(self, side, rating):
+        # depends on how often a digit appears and in which key position
+        return sum(rating[pos] * self.frequency[k]
+                   for pos, k in enumerate(side))
+
+    def build_side_tables(self):
+        """
+        Rates every order of keys each side could have, so that score only
+        has to look up both sides. Each side has far fewer orders than there
+        are permutations (30240 for 5 of 10 keys), and they're rated by
+        rating_for_one_side, so this also works if a subclass rates sides in
+        a more expensive way.
+
+        >>> optimizer = Optimizer(Config())
+        >>> layout = optimizer.to_layout('21345 67809')
+        >>> before = vars(optimizer.score(layout))
+        >>> optimizer.build_side_tables()
+        >>> vars(optimizer.score(layout)) == before
+        True
+        """
+        if self._side_tables is not None:
+            return
+
+        n = len(self.keys)
+        tables = []
+        for length, rating in (
+                (self.n_left, self.left_keys_position_rating),
+                (len(self.right), self.right_keys_position_rating)):
+            # side -> (rating, average frequency), computed exactly like
+            # score does without the tables
+            tables.append({
+                    bytes(side): (self.rating_for_one_side(side, rating),
+                                  self.average_frequency_of_side(side))
+                    for side in permutations(range(n), length)})
+        self._side_tables = tuple(tables)
+
+    def build_side_tables_for(self, n_permutations):
+        # only worth it if there are more permutations than side orders
+        n = len(self.keys)
+        if n_permutations > \
+                math.perm(n, self.n_left) + math.perm(n, len(self.right)):
+            self.build_side_tables()
+
+    def __getstate__(self):
+        # The side tables are quicker to build again than to send to other
+        # processes.
+        state = dict(vars(self))
+        state['_side_tables'] = None
+        return state
+
+    def has_linear_side_rating(self):
+        return type(self).rating_for_one_side is \
+            Optimizer.rating_for_one_side
+
+    def require_linear_side_rating(self, what):
+        if not self.has_linear_side_rating():
+            raise ValueError(f"{what} needs the linear rating of each side "
+                             f"of Optimizer.rating_for_one_side")
+
+    def get_swaps(self, a, target=None):
+        if target is None:
+            target = self.current_layout
+
+        len_target = len(target)
+        if len(a) != len_target:
+            raise ValueError("both arguments must have the same length")
+
+        char_to_current_index = {c: n for n, c in enumerate(target)}
+        swaps = []
+        n = 0
+        arr = list(a)
+        while n < len_target - 1:
+            cn = char_to_current_index[arr[n]]
+            if cn == n:
+                n += 1
+            else:
+                arr[cn], arr[n] = arr[n], arr[cn]
+                swaps.append((target[n], target[cn]))
+        return swaps
+
+    def count_swaps(self, arrangement, target=None):
+        """
+        >>> optimizer = Optimizer(Config())
+        >>> current = "12345 67890"
+        >>> optimizer.count_swaps(current, current)
+        0
+        >>> optimizer.count_swaps("54321 67890", current)
+        2
+        >>> optimizer.count_swaps("67890 12345", current)
+        5
+        >>> optimizer.count_swaps("42315 60897", current)
+        2
+        >>> optimizer.count_swaps("12345 60897", current)
+        1
+        >>> optimizer.count_swaps("12345 60987", current)
+        2
+        >>> optimizer.count_swaps("23145 67890", current)
+        2
+        >>> optimizer.count_swaps("82315 67094", current)  # 1 4, 0 8, 8 4
+        3
+        """
+        if target is None:
+            len_current = len(self.current_layout)
+            char_to_current_index = self.current_position
+        else:
+            len_current = len(target)
+            char_to_current_index = {c: n for n, c in enumerate(target)}
+
+        if len(arrangement) != len_current:
+            raise ValueError("both arguments must have the same length")
+
+        swaps = 0
+        n = 0
+        arr = list(arrangement)
+        while n < len_current - 1:
+            cn = char_to_current_index[arr[n]]
+            if cn == n:
+                n += 1
+            else:
+                swaps += 1
+                # move current character to it's target place
+                arr[cn], arr[n] = arr[n], arr[cn]
+
+        return swaps
+
+    def update_to_mirror_if_rating_equal_and_steadier(
+            self, permutations_with_rating):
+        if len(self.left) != len(self.right):
+            return  # there is no mirrored version
+
+        for i, (p, p_rating) in enumerate(permutations_with_rating):
+            p_mirrored = p[::-1]
+            p_mirrored_rating = self.score(p_mirrored).total
+
+            # fixed point ratings are only equal if they're exactly equal
+            if p_rating == p_mirrored_rating or (
+                    not self.fixed_point and
+                    math.isclose(p_rating, p_mirrored_rating)):
+                # mirrored version with same rating exists
+                p_score = self.steadiness_score(p)
+                p_mirrored_score = self.steadiness_score(p_mirrored)
+
+                if p_score < p_mirrored_score:
+                    permutations_with_rating[i] = (p_mirrored,
+                                                   p_mirrored_rating)
+
+    def steadiness_score(self, layout):
+        """
+        Returns a score that depends on how many digits stay on their current
+        side and how many digits stay in the same position (easier to learn if
+        more).
+        """
+        exact_same_position_count = 0
+
+        for k, ck in zip(layout, self.current_layout):
+            if k == ck:
+                exact_same_position_count += 1
+
+        # it's more important that frequent digits stay on the same side
+        same_side_score = sum(self.frequency[k]
+                              for k in layout[:self.n_left]
+                              if self.is_left_key[k])
+        same_side_score += sum(self.frequency[k]
+                               for k in layout[self.n_left:]
+                               if not self.is_left_key[k])
+
+        return exact_same_position_count + same_side_score * 2
+
+    def side_split_frequency_delta(self, left, right):
+        split = (left, right)
+        if split not in self._side_split_frequency_delta:
+            self._side_split_frequency_delta[split] = abs(
+                    self.average_frequency_of_side(left) -
+                    self.average_frequency_of_side(right))
+        return self._side_split_frequency_delta[split]
+
+    def side_frequency_delta(self, layout):
+        """
+        Returns the difference between the average frequency of both sides.
+        Unlike average_frequency_per_side, this doesn't depend on the order of
+        the keys (not even by float rounding), so it's the same for a whole
+        side split.
+        """
+        return self.side_split_frequency_delta(
+                bytes(sorted(layout[:self.n_left])),
+                bytes(sorted(layout[self.n_left:])))
+
+    def rating_distributions(self):
+        # Each side's rating is a weighted average of its position ratings,
+        # weighted by frequencies that add up to at most 1, so none of them
+        # can be higher than the highest position rating. The penalty is up
+        # to penalty_factor times the sum of both, which makes it negative
+        # for a negative factor.
+        highest = max(self.left_keys_position_rating +
+                      self.right_keys_position_rating)
+        penalty_factor = self.imbalance_penalty_factor
+        better_than_current = [self.current_rating * (1 + percent / 100)
+                               for percent in BETTER_THAN_CURRENT_BY]
+        return {
+            'left': Distribution(0, highest),
+            'right': Distribution(0, highest),
+            'total': Distribution(min(0, highest * (1 - penalty_factor)),
+                                  highest * max(1, 1 - penalty_factor),
+                                  thresholds=better_than_current),
+            'imbalance_penalty': Distribution(
+                    highest * min(penalty_factor, 0),
+                    highest * max(penalty_factor, 1))}
+
+    def sweep(self, engine='loop', workers=1, count=10, mirrored=None,
+              start_rank=0, end_rank=None, progress=None):
+        """
+        Checks all permutations and returns a SweepResult with the best count
+        of them. 'loop' rates them one by one, 'swaps' goes through them by
+        swapping two keys at a time and only updates the ratings, and 'numpy'
+        rates them in large blocks (needs numpy). All give the same results.
+        With more than one worker (0 is one for every CPU), they are checked
+        by as many processes.
+
+        If mirrored (by default if the optimizer is mirror_symmetric), only
+        the layouts with a smaller key on the far left than on the far right
+        are rated, and each one's mirrored version gets the same ratings.
+
+        Only the permutations with a rank (see lehmer_rank) from start_rank up
+        to end_rank are checked, all of them by default. Merging the results
+        for ranges that cover all permutations gives the same results as
+        checking them at once.
+
+        If given, progress (a SweepProgress) is updated while checking them.
+        It only counts the permutations that are rated, n_checked of them.
+
+        >>> optimizer = Optimizer(Config(
+        ...         current='1234 5678',
+        ...         left_keys_position_rating=[0.55, 0.8, 1, 0.98]))
+        >>> loop = {mirrored: optimizer.sweep('loop', mirrored=mirrored)
+        ...         for mirrored in (True, False)}
+        >>> [(engine, mirrored) for engine in ('swaps', 'numpy')
+        ...  for mirrored in (True, False)
+        ...  if optimizer.sweep(engine, mirrored=mirrored).to_json() !=
+        ...  loop[mirrored].to_json()]
+        []
+
+        Only with fixed point, a layout and its mirrored version always get
+        exactly the same ratings, and so rating only half of them always
+        gives the same results:
+
+        >>> fixed = Optimizer(optimizer.config.updated(fixed_point=True))
+        >>> half = fixed.sweep('numpy').to_json()
+        >>> half == fixed.sweep('numpy', mirrored=False).to_json()
+        True
+        """
+        if mirrored is None:
+            mirrored = self.mirror_symmetric
+        if mirrored:
+            self.require_linear_side_rating("rating only half of the "
+                                            "permutations")
+        if mirrored and not self.mirror_symmetric:
+            raise ValueError("layouts are not rated the same as their "
+                             "mirrored versions")
+
+        n_permutations = math.factorial(len(self.keys))
+        if end_rank is None:
+            end_rank = n_permutations
+        if not 0 <= start_rank <= end_rank <= n_permutations:
+            raise ValueError(f"ranks have to be between 0 and "
+                             f"{n_permutations}")
+
+        if engine == 'loop':
+            check_all = self.check_all_permutations
+        elif engine == 'swaps':
+            check_all = self.check_all_permutations_by_swaps
+        elif engine == 'numpy':
+            check_all = self.check_all_permutations_numpy
+        else:
+            raise ValueError(f"unknown engine {engine!r}")
+        if engine != 'loop':
+            self.require_linear_side_rating(f"the {engine} engine")
+
+        workers = workers or os.cpu_count()
+
+        if workers > 1:
+            return self.check_all_permutations_in_parallel(
+                    check_all, workers, count, mirrored, start_rank, end_rank,
+                    progress)
+
+        if engine == 'loop':
+            self.build_side_tables_for(end_rank - start_rank)
+
+        sweep = SweepResult(self, count, mirrored)
+        for prefix in rank_prefixes(len(self.keys), start_rank, end_rank):
+            sweep.merge(check_all(prefix, count=count, mirrored=mirrored,
+                                  progress=progress))
+        return sweep
+
+    def n_checked(self, start_rank=0, end_rank=None, mirrored=None):
+        """
+        Returns how many permutations sweep rates with the same arguments. If
+        mirrored, those are only the ones with a smaller key on the far left
+        than on the far right.
+
+        >>> optimizer = Optimizer(Config())
+        >>> optimizer.n_checked(), optimizer.n_checked(mirrored=False)
+        (1814400, 3628800)
+        >>> optimizer.n_checked(0, 362880)
+        362880
+        """
+        if mirrored is None:
+            mirrored = self.mirror_symmetric
+
+        n = len(self.keys)
+        if end_rank is None:
+            end_rank = math.factorial(n)
+        return sum(n_checked_with_prefix(n, prefix, mirrored)
+                   for prefix in rank_prefixes(n, start_rank, end_rank))
+
+    def check_all_permutations(self, prefix=(), count=10, mirrored=False,
+                               progress=None, seed=None):
+        # Only the permutations starting with prefix, if given. If there is a
+        # seed (see seed_sweep), the results start out with it.
+        sweep = SweepResult(self, count, mirrored)
+        if seed is not None:
+            sweep.merge(seed)
+        rest = [k for k in range(len(self.keys)) if k not in prefix]
+        self.build_side_tables_for(math.factorial(len(rest)))
+
+        # Progress is updated in batches. Only the phases of the last
+        # permutation of each batch are timed, and the time of the whole
+        # batch is split up like that.
+        batch = 0
+        batch_start = time.perf_counter()
+
+        for p in permutations(rest):
+            p = bytes(prefix + p)
+            if mirrored and p[0] > p[-1]:
+                continue  # added along with its mirrored version
+            batch += 1
+
+            # only the few that could make it into the results are added,
+            # which counts their swaps and steadiness
+            if progress is None or batch < PROGRESS_BATCH:
+                result = self.score(p)
+                if sweep.could_change(p, result):
+                    sweep.add(p, result)
+                sweep.tally(result)
+                continue
+
+            start = time.perf_counter()
+            result = self.score(p)
+            scored = time.perf_counter()
+            if sweep.could_change(p, result):
+                sweep.add(p, result)
+            added = time.perf_counter()
+            sweep.tally(result)
+            tallied = time.perf_counter()
+
+            progress.add_sampled(batch, tallied - batch_start, {
+                    'scoring': scored - start,
+                    'top-k and frontier': added - scored,
+                    'distributions': tallied - added})
+            batch = 0
+            batch_start = tallied
+
+        if progress is not None:
+            progress.add(batch)
+        return sweep
+
+    def check_all_permutations_by_swaps(self, prefix=(), count=10,
+                                        mirrored=False, progress=None,
+                                        seed=None):
+        # Goes through the permutations in the order of Heap's algorithm,
+        # where each one only differs from the previous one by a single swap.
+        # The rating and frequency sum of each side, the number of swaps from
+        # current and the steadiness are updated for every swap instead of
+        # computed from scratch. The floats slowly drift away from what score
+        # gives, so they're only used to skip permutations that can't make it
+        # into the results. The others are rated exactly, so the results are
+        # the same as with the other engines. If mirrored, Heap's algorithm
+        # still goes through all permutations, but only half of them are
+        # checked.
+        n_left = len(self.left)
+        n_right = len(self.right)
+        rating = self.left_keys_position_rating + \
+            self.right_keys_position_rating
+        max_delta = self.max_frequency_delta_between_sides
+        penalty_factor = self.imbalance_penalty_factor
+        margin = 1e-6
+
+        # the prefix stays in place, Heap's algorithm only swaps the rest
+        n = len(self.keys)
+        p = list(prefix) + [k for k in range(n) if k not in prefix]
+        first = len(prefix)
+
+        frequency = [self.frequency[k] for k in p]
+        is_left_key = [self.is_left_key[k] for k in p]
+        target = [self.current_position[k] for k in p]
+
+        def from_scratch():
+            left = sum(rating[pos] * frequency[pos] for pos in range(n_left))
+            right = sum(rating[pos] * frequency[pos]
+                        for pos in range(n_left, n))
+            left_frequency = sum(frequency[:n_left])
+            right_frequency = sum(frequency[n_left:])
+            same_side_frequency = sum(frequency[pos] for pos in range(n)
+                                      if is_left_key[pos] == (pos < n_left))
+            return (left, right, left_frequency, right_frequency,
+                    same_side_frequency)
+
+        (left, right, left_frequency, right_frequency,
+         same_side_frequency) = from_scratch()
+        same_position_count = sum(target[pos] == pos for pos in range(n))
+
+        # the same for the mirrored version, where the key at pos is at
+        # n - 1 - pos, and every key is on the other side
+        mirrored_same_position_count = sum(target[pos] == n - 1 - pos
+                                           for pos in range(n))
+        frequency_sum = sum(frequency)
+
+        cycles = 0
+        seen = [False] * n
+        for pos in range(n):
+            if not seen[pos]:
+                cycles += 1
+                while not seen[pos]:
+                    seen[pos] = True
+                    pos = target[pos]
+
+        sweep = SweepResult(self, count, mirrored)
+        if seed is not None:
+            sweep.merge(seed)
+        best = sweep.best
+        worst = sweep.worst
+        most_balanced = sweep.most_balanced
+        frontier = sweep.frontier
+
+        # for adding to the distributions directly, in the order of the
+        # values below
+        times = 2 if mirrored else 1
+        histograms = [(d.low, d.scale, d.counts, t)
+                      for d, t in zip(sweep.distributions.values(),
+                                      (1, 1, times, times))]
+        if mirrored:
+            # for the right rating, which is the left one of the mirrored
+            # version, and the other way around
+            histograms += histograms[:2]
+        thresholds = sweep.distributions['total'].thresholds
+        between = sweep.distributions['total'].between
+
+        counters = [0] * n
+        steps_since_from_scratch = 0
+
+        # for progress, which is updated along with from_scratch
+        checked = 0
+        candidates_seconds = 0
+        batch_start = time.perf_counter()
+        i = first
+        while True:
+            if mirrored and p[0] > p[n - 1]:
+                pass  # checked along with its mirrored version
+            else:
+                checked += 1
+                raw = left + right
+                delta = abs(left_frequency / n_left -
+                            right_frequency / n_right)
+                imbalance_penalty = raw * (delta / max_delta) * penalty_factor
+                total = raw - imbalance_penalty
+                swaps = n - cycles
+                steadiness = same_position_count + same_side_frequency * 2
+
+                # The mirrored version has the same rating, but might need
+                # fewer swaps and be steadier. We only know the fewest swaps
+                # it could need, which is enough to rule most of them out.
+                mirrored_could_join = mirrored and not frontier.dominated(
+                        total + margin,
+                        (n - mirrored_same_position_count + 1) // 2,
+                        mirrored_same_position_count +
+                        (frequency_sum - same_side_frequency) * 2 + margin)
+
+                result = None
+                if (total > best.threshold - margin or
+                        -total > worst.threshold - margin or
+                        -delta > most_balanced.threshold[0] - margin or
+                        not frontier.dominated(total + margin, swaps,
+                                               steadiness + margin) or
+                        mirrored_could_join):
+                    candidate_start = time.perf_counter()
+                    layout = bytes(p)
+                    result = self.score(layout)
+                    sweep.add(layout, result, swaps=swaps)
+                    candidates_seconds += \
+                        time.perf_counter() - candidate_start
+
+                # The ratings might only end up in another bin or on the other
+                # side of a threshold if they are close to it. Only then the
+                # exact ones are needed.
+                if result is None:
+                    values = (left, right, total, imbalance_penalty)
+                    if mirrored:
+                        values += (right, left)
+
+                    bins = []
+                    for value, (low, scale, counts, _) in zip(values,
+                                                              histograms):
+                        b = int((value - margin - low) * scale)
+                        if b != int((value + margin - low) * scale) or \
+                                not 0 <= b < len(counts):
+                            result = self.score(bytes(p))
+                            break
+                        bins.append(b)
+
+                    below = bisect_left(thresholds, total - margin)
+                    if result is None and \
+                            below != bisect_left(thresholds, total + margin):
+                        result = self.score(bytes(p))
+
+                    if result is None:
+                        for b, (_, _, counts, t) in zip(bins, histograms):
+                            counts[b] += t
+                        between[below] += times
+
+                if result is not None:
+                    sweep.tally(result)
+
+            # next permutation (iterative version of Heap's algorithm)
+            while i < n and counters[i] >= i - first:
+                counters[i] = 0
+                i += 1
+            if i == n:
+                if progress is not None:
+                    progress.add(checked)
+                break
+
+            a = first + (counters[i] if (i - first) % 2 else 0)
+            b = i
+            counters[i] += 1
+            i = first + 1
+
+            # are a and b in the same cycle? then swapping splits it in two
+            pos = target[a]
+            while pos != a and pos != b:
+                pos = target[pos]
+            cycles += 1 if pos == b else -1
+
+            same_position_count -= (target[a] == a) + (target[b] == b)
+            mirrored_same_position_count -= \
+                (target[a] == n - 1 - a) + (target[b] == n - 1 - b)
+            target[a], target[b] = target[b], target[a]
+            same_position_count += (target[a] == a) + (target[b] == b)
+            mirrored_same_position_count += \
+                (target[a] == n - 1 - a) + (target[b] == n - 1 - b)
+
+            fa = frequency[a]
+            fb = frequency[b]
+            if b < n_left:
+                left += (rating[a] - rating[b]) * (fb - fa)
+            elif a >= n_left:
+                right += (rating[a] - rating[b]) * (fb - fa)
+            else:
+                left += rating[a] * (fb - fa)
+                right += rating[b] * (fa - fb)
+                left_frequency += fb - fa
+                right_frequency += fa - fb
+                if is_left_key[a] == is_left_key[b]:
+                    same_side_frequency += \
+                        fb - fa if is_left_key[a] else fa - fb
+                else:
+                    same_side_frequency += \
+                        fa + fb if is_left_key[b] else -fa - fb
+
+            p[a], p[b] = p[b], p[a]
+            frequency[a], frequency[b] = fb, fa
+            is_left_key[a], is_left_key[b] = is_left_key[b], is_left_key[a]
+
+            steps_since_from_scratch += 1
+            if steps_since_from_scratch == 1024:
+                steps_since_from_scratch = 0
+                (left, right, left_frequency, right_frequency,
+                 same_side_frequency) = from_scratch()
+
+                if progress is not None:
+                    batch_end = time.perf_counter()
+                    updating_seconds = \
+                        batch_end - batch_start - candidates_seconds
+                    progress.add(checked, {
+                            'swapping and updating': updating_seconds,
+                            'rating candidates': candidates_seconds})
+                    checked = 0
+                    candidates_seconds = 0
+                    batch_start = batch_end
+
+        return sweep
+
+    def check_all_permutations_in_parallel(self, check_all, workers,
+                                           count=10, mirrored=False,
+                                           start_rank=0, end_rank=None,
+                                           progress=None):
+        # Every worker checks the permutations starting with a different
+        # prefix. There should be a lot more prefixes than workers, so they
+        # all finish at about the same time. Progress only counts finished
+        # prefixes, without the time of each phase. check_all is one of the
+        # check_all_permutations methods.
+        #
+        # Each prefix starts out with the same seed, so that its first
+        # permutations don't all have to be added (which for the numpy engine
+        # means counting the swaps of whole blocks). The seed ends up in the
+        # results of every prefix, which is fine since adding the same layout
+        # again changes nothing.
+        from concurrent.futures import ProcessPoolExecutor
+
+        n = len(self.keys)
+
+        # The numpy engine rates blocks of permutations that share their first
+        # n - 8 keys (see permutation_blocks). Longer prefixes would only
+        # make the blocks smaller.
+        max_prefix_length = n
+        if check_all.__name__ == 'check_all_permutations_numpy':
+            max_prefix_length = max(n - 8, 0)
+
+        prefix_length = 0
+        prefixes = list(rank_prefixes(n, start_rank, end_rank))
+        while prefix_length < max_prefix_length and \
+                len(prefixes) < 4 * workers:
+            prefix_length += 1
+            prefixes = list(rank_prefixes(n, start_rank, end_rank,
+                                          prefix_length))
+
+        # A prefix can have fewer permutations than there are side orders,
+        # but every process checks a lot of prefixes with the same tables.
+        if end_rank is None:
+            end_rank = math.factorial(n)
+        n_permutations = end_rank - start_rank \
+            if check_all.__name__ == 'check_all_permutations' else 0
+        seed = self.seed_sweep(count, mirrored, start_rank, end_rank)
+        check_prefix = partial(check_prefix_in_worker, check_all.__name__,
+                               count=count, mirrored=mirrored, seed=seed)
+
+        sweep = SweepResult(self, count, mirrored)
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(self, n_permutations)) as executor:
+            for prefix, shard in zip(prefixes,
+                                     executor.map(check_prefix, prefixes)):
+                sweep.merge(shard)
+                if progress is not None:
+                    progress.add(n_checked_with_prefix(n, prefix, mirrored))
+
+        return sweep
+
+    def seed_sweep(self, count=10, mirrored=False, start_rank=0,
+                   end_rank=None):
+        """
+        Returns a SweepResult with only a few of the permutations between
+        start_rank and end_rank added: the ones within two swaps of current
+        and, if the rating is linear, the best ones. Everything that can't
+        beat them can't make it into the results of checking all of them.
+        The distributions stay empty.
+        """
+        n = len(self.keys)
+        if end_rank is None:
+            end_rank = math.factorial(n)
+
+        layouts = list(self.layouts_within_swaps(2))
+        if self.has_linear_side_rating():
+            layouts += [layout for layout, _ in self.top_k(count)]
+
+        seed = SweepResult(self, count, mirrored)
+        for layout in layouts:
+            if mirrored and layout[0] > layout[-1]:
+                layout = layout[::-1]  # added with its mirrored version
+            if start_rank <= lehmer_rank(layout) < end_rank:
+                seed.add(layout, self.score(layout))
+        return seed
+
+    def rate_block(self, block):
+        """
+        Returns the left, right and total rating and the imbalance penalty of
+        every row of block as arrays. The sums are done in the same order as
+        in score, so that we get exactly the same floats.
+        """
+        import numpy as np
+
+        self.require_linear_side_rating("rate_block")
+
+        n_left = self.n_left
+        n_right = len(self.right)
+        left_rating = self.left_keys_position_rating
+        right_rating = self.right_keys_position_rating
+        f = np.array(self.frequency)[block]
+
+        left = left_rating[0] * f[:, 0]
+        left_frequency = f[:, 0].copy()
+        for pos in range(1, n_left):
+            left += left_rating[pos] * f[:, pos]
+            left_frequency += f[:, pos]
+
+        right = right_rating[0] * f[:, n_left]
+        right_frequency = f[:, n_left].copy()
+        for pos in range(1, n_right):
+            right += right_rating[pos] * f[:, n_left + pos]
+            right_frequency += f[:, n_left + pos]
+
+        total = left + right
+        norm_frequency_delta = np.abs(left_frequency / n_left -
+                                      right_frequency / n_right)
+        norm_frequency_delta /= self.max_frequency_delta_between_sides
+        imbalance_penalty = total * norm_frequency_delta
+        imbalance_penalty *= self.imbalance_penalty_factor
+        if self.fixed_point:
+            imbalance_penalty = to_fixed_point(imbalance_penalty,
+                                               2 * FIXED_POINT_BITS)
+        total -= imbalance_penalty
+
+        return left, right, total, imbalance_penalty
+
+    def target_positions(self, target=None):
+        # where each key is in target (current by default), as an array
+        import numpy as np
+
+        if target is None:
+            return np.array(self.current_position)
+        target_position = np.empty(len(target), dtype=np.intp)
+        target_position[list(target)] = np.arange(len(target))
+        return target_position
+
+    def count_swaps_block(self, block, target=None):
+        """
+        Returns count_swaps for every row of block, an array of layouts.
+
+        >>> optimizer = Optimizer(Config())
+        >>> current = optimizer.to_layout("12345 67890")
+        >>> block = [list(optimizer.to_layout(p)) for p in (
+        ...         "12345 67890", "54321 67890", "67890 12345",
+        ...         "42315 60897", "12345 60897", "12345 60987",
+        ...         "23145 67890", "82315 67094")]
+        >>> optimizer.count_swaps_block(block, current).tolist()
+        [0, 2, 5, 2, 1, 2, 2, 3]
+        """
+        import numpy as np
+
+        block = np.asarray(block)
+        target_position = self.target_positions(target)
+        if block.shape[1] != len(target_position):
+            raise ValueError("both arguments must have the same length")
+        return swap_counts(block, target_position)
+
+    def get_swaps_block(self, block, target=None):
+        """
+        Returns get_swaps for every row of block, an array of layouts. The
+        swaps of all rows are done at the same time.
+
+        >>> optimizer = Optimizer(Config())
+        >>> block = [list(optimizer.to_layout(p))
+        ...          for p in ("12345 67890", "82315 67094", "67890 12345")]
+        >>> optimizer.get_swaps_block(block) == [
+        ...         optimizer.get_swaps(bytes(layout)) for layout in block]
+        True
+        """
+        import numpy as np
+
+        if target is None:
+            target = self.current_layout
+        block = np.array(block, dtype=np.intp)
+        target_position = self.target_positions(target)
+        target = np.array(list(target))
+        if block.shape[1] != len(target):
+            raise ValueError("both arguments must have the same length")
+
+        swaps = [[] for _ in range(len(block))]
+        n = np.zeros(len(block), dtype=np.intp)
+        rows = np.flatnonzero(n < len(target) - 1)
+        while len(rows):
+            rows_n = n[rows]
+            cn = target_position[block[rows, rows_n]]
+            in_place = cn == rows_n
+            n[rows[in_place]] += 1
+
+            # move the key at n to its target place in the others
+            swapping = ~in_place
+            rows, rows_n, cn = rows[swapping], rows_n[swapping], cn[swapping]
+            block[rows, rows_n], block[rows, cn] = \
+                block[rows, cn], block[rows, rows_n]
+            for row, a, b in zip(rows.tolist(), target[rows_n].tolist(),
+                                 target[cn].tolist()):
+                swaps[row].append((a, b))
+            rows = np.flatnonzero(n < len(target) - 1)
+        return swaps
+
+    def steadiness_block(self, block):
+        """
+        Returns steadiness_score for every row of block, an array of layouts
+        (up to float rounding).
+
+        >>> import numpy as np
+        >>> optimizer = Optimizer(Config())
+        >>> block = [list(optimizer.to_layout(p))
+        ...          for p in ("12345 67890", "82315 67094", "67890 12345")]
+        >>> np.allclose(optimizer.steadiness_block(block), [
+        ...         optimizer.steadiness_score(bytes(layout))
+        ...         for layout in block])
+        True
+        """
+        import numpy as np
+
+        block = np.asarray(block)
+        n_left = self.n_left
+        f = np.array(self.frequency)[block]
+        is_left = np.array(self.is_left_key)
+
+        same_position_count = np.count_nonzero(
+                block == np.array(list(self.current_layout)), axis=1)
+        same_side_frequency = np.where(is_left[block[:, :n_left]],
+                                       f[:, :n_left], 0).sum(axis=1)
+        same_side_frequency += np.where(is_left[block[:, n_left:]],
+                                        0, f[:, n_left:]).sum(axis=1)
+        return same_position_count + same_side_frequency * 2
+
+    def check_all_permutations_numpy(self, prefix=(), count=10,
+                                     mirrored=False, progress=None,
+                                     seed=None):
+        # Scores whole blocks of permutations at once, with the same floats
+        # and thus the same results as check_all_permutations.
+        import numpy as np
+
+        n_left = self.n_left
+        n_right = len(self.right)
+        frequency = np.array(self.frequency)
+        current_layout = np.array(list(self.current_layout))
+
+        sweep = SweepResult(self, count, mirrored)
+        if seed is not None:
+            sweep.merge(seed)
+
+        for block in permutation_blocks(len(self.keys), prefix):
+            start = time.perf_counter()
+            if mirrored:
+                # the others are added along with their mirrored versions
+                block = block[block[:, 0] < block[:, -1]]
+                if not len(block):
+                    continue
+
+            left, right, total, imbalance_penalty = self.rate_block(block)
+            scored = time.perf_counter()
+            sweep.tally_block(left, right, total, imbalance_penalty)
+            tallied = time.perf_counter()
+
+            # same as side_frequency_delta, by adding the frequencies in the
+            # order of the keys (adding 0 for keys on the other side changes
+            # nothing)
+            on_left = np.zeros(block.shape, dtype=bool)
+            np.put_along_axis(on_left, block[:, :n_left].astype(np.intp),
+                              True, axis=1)
+            sorted_left_frequency = np.zeros(len(block))
+            sorted_right_frequency = np.zeros(len(block))
+            for k in range(len(self.keys)):
+                sorted_left_frequency += np.where(on_left[:, k],
+                                                  frequency[k], 0)
+                sorted_right_frequency += np.where(on_left[:, k],
+                                                   0, frequency[k])
+            frequency_delta = np.abs(sorted_left_frequency / n_left -
+                                     sorted_right_frequency / n_right)
+
+            # Only the best of each block can change the results. Rows come in
+            # order, so argmin and argmax find the one that wins ties.
+            candidates = [np.flatnonzero(total >= sweep.best.threshold)]
+            if len(candidates[0]) > count:
+                best_ratings = total[candidates[0]]
+                kth_best_rating = -np.partition(-best_ratings,
+                                                count - 1)[count - 1]
+                candidates[0] = candidates[0][best_ratings >= kth_best_rating]
+
+            candidates.append([np.argmin(total)])
+
+            most_balanced = frequency_delta == frequency_delta.min()
+            candidates.append([np.argmax(np.where(most_balanced, total,
+                                                  -np.inf))])
+
+            frontier_start = time.perf_counter()
+
+            # Counting swaps is the expensive part, so first check which ones
+            # could make it into the frontier with the fewest possible swaps:
+            # every swap moves at most two keys into the right position. The
+            # mirrored versions have the same rating, but other swaps and
+            # steadiness.
+            for layouts in [block, block[:, ::-1]] if mirrored else [block]:
+                steadiness = self.steadiness_block(layouts)
+                same_position_count = np.count_nonzero(
+                        layouts == current_layout, axis=1)
+                min_swaps = (len(self.keys) - same_position_count + 1) // 2
+                rows = np.flatnonzero(not_dominated(sweep.frontier, total,
+                                                    min_swaps, steadiness))
+                swaps = self.count_swaps_block(layouts[rows])
+                could_join = not_dominated(sweep.frontier, total[rows],
+                                           swaps, steadiness[rows])
+                rows, swaps = rows[could_join], swaps[could_join]
+                candidates.append(rows[pareto_rows(total[rows], swaps,
+                                                   steadiness[rows])])
+
+            frontier_end = time.perf_counter()
+
+            # adding the best first means fewer of the others make it in at
+            # first
+            candidates = set(np.concatenate(candidates))
+            for i in sorted(candidates, key=lambda i: -total[i]):
+                result = RatingResult(float(left[i]), float(right[i]),
+                                      float(total[i]),
+                                      float(imbalance_penalty[i]))
+                sweep.add(block[i].tobytes(), result,
+                          float(frequency_delta[i]))
+
+            if progress is not None:
+                # the frontier without counting swaps, top-k and the others
+                adding_seconds = (frontier_start - tallied +
+                                  time.perf_counter() - frontier_end)
+                progress.add(len(block), {
+                        'scoring': scored - start,
+                        'distributions': tallied - scored,
+                        'swap counting': frontier_end - frontier_start,
+                        'top-k and frontier': adding_seconds})
+
+        return sweep
+
+    def top_k(self, count=10):
+        """
+        Returns the same best permutations and ratings as checking all of
+        them, without doing so.
+        """
+        self.require_linear_side_rating("top_k")
+
+        # the best permutation of each split (rearrangement inequality)
+        keys_by_frequency = sorted(range(len(self.keys)),
+                                   key=lambda k: -self.frequency[k])
+        split_bests = []
+
+        for left in combinations(range(len(self.keys)), self.n_left):
+            right = [k for k in keys_by_frequency if k not in left]
+            left = [k for k in keys_by_frequency if k in left]
+            p = (best_order_of_side(left, self.left_keys_position_rating) +
+                 best_order_of_side(right, self.right_keys_position_rating))
+            split_bests.append((self.score(p).total, left, right))
+
+        split_bests.sort(key=lambda s: -s[0])
+
+        best = TopK(count)
+        for split_best_rating, left, right in split_bests:
+            if split_best_rating < best.threshold * (1 - RATING_TOLERANCE):
+                break
+
+            for p in self.best_permutations_of_split(left, right, count):
+                best.add(p, self.score(p).total)
+
+        return best.items()
+
+    def best_orders_of_side(self, keys, rating, count):
+        """
+        Returns the orders of keys with the highest rating for a side, best
+        first. Includes every order that ties with the last one.
+        """
+        orders = [(self.rating_for_one_side(p, rating), bytes(p))
+                  for p in permutations(keys)]
+        orders.sort(key=lambda o: (-o[0], o[1]))
+
+        if len(orders) > count:
+            threshold = orders[count - 1][0] * (1 - RATING_TOLERANCE)
+            while len(orders) > count and orders[-1][0] < threshold:
+                orders.pop()
+
+        return orders
+
+    def best_permutations_of_split(self, left, right, count):
+        # The imbalance penalty is the same for every permutation of a side
+        # split, so the best ones combine the best orders of each side.
+        lefts = self.best_orders_of_side(left, self.left_keys_position_rating,
+                                         count)
+        rights = self.best_orders_of_side(right,
+                                          self.right_keys_position_rating,
+                                          count)
+
+        # go through the pairs by decreasing sum, starting with the two best
+        # orders
+        heap = [(-lefts[0][0] - rights[0][0], 0, 0)]
+        seen = {(0, 0)}
+        threshold = None
+        perms = []
+
+        while heap:
+            neg_sum, i, j = heappop(heap)
+            if threshold is not None and -neg_sum < threshold:
+                break
+
+            perms.append(lefts[i][1] + rights[j][1])
+            if len(perms) == count:
+                threshold = -neg_sum * (1 - RATING_TOLERANCE)
+
+            for pair in ((i + 1, j), (i, j + 1)):
+                if pair not in seen and pair[0] < len(lefts) and \
+                        pair[1] < len(rights):
+                    seen.add(pair)
+                    heappush(heap, (-lefts[pair[0]][0] - rights[pair[1]][0],
+                                    *pair))
+
+        return perms
+
+    def best_permutations_by_checking_all(self, count=10):
+        best = TopK(count)
+        for p in permutations(range(len(self.keys))):
+            p = bytes(p)
+            best.add(p, self.score(p).total)
+        return best.items()
+
+    def branch_and_bound(self, count=10):
+        """
+        Returns the same best permutations and ratings as checking all of
+        them, for rows with too many keys for that (e.g. 12 to 14). Keys are
+        placed on one position after the other, the best position first, and
+        a partial layout is dropped once no way to place the other keys can
+        beat the best count layouts so far. The other keys add at most the
+        rating of the most frequent one on the best free position and so on
+        (rearrangement inequality), and at least the lowest imbalance penalty
+        that the frequencies left for each side allow.
+
+        >>> optimizer = Optimizer(Config(
+        ...         current='1234 5678',
+        ...         left_keys_position_rating=[0.55, 0.8, 1, 0.98]))
+        >>> best = optimizer.best_permutations_by_checking_all(5)
+        >>> optimizer.branch_and_bound(5) == best
+        True
+        """
+        self.require_linear_side_rating("branch_and_bound")
+
+        n = len(self.keys)
+        n_left, n_right = self.n_left, len(self.right)
+        rating = self.left_keys_position_rating + \
+            self.right_keys_position_rating
+        frequency = self.frequency
+        total_frequency = sum(frequency)
+        max_delta = self.max_frequency_delta_between_sides
+        penalty_factor = self.imbalance_penalty_factor
+
+        # the positions in the order we place keys on them, and the ratings
+        # of the ones that are still free and how many of them are on the
+        # left before placing a key on each
+        positions = sorted(range(n), key=lambda pos: -rating[pos])
+        free_ratings = [[rating[pos] for pos in positions[depth:]]
+                        for depth in range(n + 1)]
+        free_left = [sum(pos < n_left for pos in positions[depth:])
+                     for depth in range(n + 1)]
+
+        def norm_delta(left_frequency):
+            return (left_frequency / n_left -
+                    (total_frequency - left_frequency) / n_right) / max_delta
+
+        def upper_bound(depth, keys, raw, left_frequency):
+            # keys are the ones that are still free, most frequent first
+            raw += sum(r * frequency[k]
+                       for r, k in zip(free_ratings[depth], keys))
+
+            # the left side gets between the least and the most frequent of
+            # them, and the penalty is linear in between
+            n_free_left = free_left[depth]
+            lowest = norm_delta(left_frequency + sum(
+                    frequency[k] for k in keys[len(keys) - n_free_left:]))
+            highest = norm_delta(left_frequency + sum(
+                    frequency[k] for k in keys[:n_free_left]))
+            if lowest <= 0 <= highest:
+                least_delta = 0
+            else:
+                least_delta = min(abs(lowest), abs(highest))
+            most_delta = max(abs(lowest), abs(highest))
+
+            return raw * max(1 - penalty_factor * least_delta,
+                             1 - penalty_factor * most_delta, 0)
+
+        best = TopK(count)
+        layout = [None] * n
+
+        def place(depth, keys, raw, left_frequency):
+            if depth == n:
+                p = bytes(layout)
+                best.add(p, self.score(p).total)
+                return
+
+            pos = positions[depth]
+            for i, k in enumerate(keys):
+                rest = keys[:i] + keys[i + 1:]
+                k_raw = raw + rating[pos] * frequency[k]
+                k_left_frequency = left_frequency
+                if pos < n_left:
+                    k_left_frequency += frequency[k]
+
+                bound = upper_bound(depth + 1, rest, k_raw, k_left_frequency)
+                if bound < best.threshold * (1 - RATING_TOLERANCE):
+                    continue
+
+                layout[pos] = k
+                place(depth + 1, rest, k_raw, k_left_frequency)
+
+        place(0, sorted(range(n), key=lambda k: -frequency[k]), 0, 0)
+        return best.items()
+
+    def layouts_within_swaps(self, max_swaps, target=None):
+        """
+        Yields every layout that can be reached from target (current by
+        default) with at most max_swaps swaps, each of them once.
+
+        >>> optimizer = Optimizer(Config())
+        >>> target = optimizer.to_layout('12345 67890')
+        >>> len(list(optimizer.layouts_within_swaps(2, target)))
+        916
+        >>> all(optimizer.count_swaps(p, target) <= 2
+        ...     for p in optimizer.layouts_within_swaps(2, target))
+        True
+        """
+        if target is None:
+            target = self.current_layout
+
+        # A layout needs as many swaps as the number of keys it moves minus
+        # the number of cycles they move in. Every set of cycles is only
+        # generated once, by starting each cycle with its smallest position.
+        for cycles in swap_cycles(tuple(range(len(target))), max_swaps):
+            layout = bytearray(target)
+            for cycle in cycles:
+                for pos, next_pos in zip(cycle, cycle[1:] + cycle[:1]):
+                    layout[next_pos] = target[pos]
+            yield bytes(layout)
+
+    def best_within_swaps(self, max_swaps, target=None, count=1,
+                          constraints=None):
+        # There are only a few thousand layouts for two or three swaps, so
+        # this doesn't need to check all permutations.
+        best = TopK(count)
+        for layout in self.layouts_within_swaps(max_swaps, target):
+            if constraints is None or constraints.allows(self, layout):
+                best.add(layout, self.score(layout).total)
+        return best.items()
+
+    def key_index(self, key):
+        if key not in self.keys:
+            raise ValueError(f"{key!r} is not a key of {self.current!r}")
+        return self.keys.index(key)
+
+    def hand_changes(self, layout):
+        # how many keys are on the other side than in current
+        return sum(self.is_left_key[k] != (pos < self.n_left)
+                   for pos, k in enumerate(layout))
+
+    def feasible_layouts(self, constraints):
+        """
+        Yields every layout the constraints allow, without going through the
+        others.
+
+        >>> optimizer = Optimizer(Config())
+        >>> len(list(optimizer.feasible_layouts(Constraints(keep_sides=True))))
+        14400
+        >>> constraints = Constraints(
+        ...         pinned={'0': 9},
+        ...         forbidden={'1': optimizer.pinky_positions},
+        ...         max_hand_changes=2)
+        >>> layouts = list(optimizer.feasible_layouts(constraints))
+        >>> len(layouts), all(constraints.allows(optimizer, p)
+        ...                   for p in layouts)
+        (50688, True)
+        """
+        n = len(self.keys)
+        allowed = constraints.allowed_positions(self)
+
+        # A key that can only go to one position takes it from the others,
+        # and a position that only one key can go to is taken by it.
+        changed = True
+        while changed:
+            changed = False
+            for k, positions in enumerate(allowed):
+                if len(positions) == 1:
+                    for other in range(n):
+                        if other != k and positions & allowed[other]:
+                            allowed[other] -= positions
+                            changed = True
+
+            for pos in range(n):
+                keys = [k for k in range(n) if pos in allowed[k]]
+                if len(keys) == 1 and len(allowed[keys[0]]) > 1:
+                    allowed[keys[0]] = {pos}
+                    changed = True
+
+        if not all(allowed):
+            return
+
+        candidates = [[k for k in range(n) if pos in allowed[k]]
+                      for pos in range(n)]
+
+        # positions are filled from left to right, so a key has to be placed
+        # once we're at the last position it can go to
+        due = [[] for _ in range(n)]
+        for k, positions in enumerate(allowed):
+            due[max(positions)].append(k)
+
+        # Every key of the right side that ends up on the left side pushes one
+        # of the left side to the right side, so we only need to count the
+        # first.
+        max_right_keys_on_left = n
+        if constraints.max_hand_changes is not None:
+            max_right_keys_on_left = constraints.max_hand_changes // 2
+
+        layout = bytearray(n)
+        used = [False] * n
+
+        def fill(pos, right_keys_on_left):
+            if pos == n:
+                yield bytes(layout)
+                return
+
+            keys = [k for k in due[pos] if not used[k]]
+            if len(keys) > 1:
+                return
+            if not keys:
+                keys = candidates[pos]
+
+            for k in keys:
+                if used[k]:
+                    continue
+
+                moves_hand = pos < self.n_left and not self.is_left_key[k]
+                if moves_hand and right_keys_on_left == max_right_keys_on_left:
+                    continue
+
+                used[k] = True
+                layout[pos] = k
+                yield from fill(pos + 1, right_keys_on_left + moves_hand)
+                used[k] = False
+
+        yield from fill(0, 0)
+
+    def best_feasible(self, constraints, count=1):
+        best = TopK(count)
+        for layout in self.feasible_layouts(constraints):
+            best.add(layout, self.score(layout).total)
+        return best.items()
+
+    def rating_upper_bound(self):
+        """
+        Returns a rating no layout can beat, or None if there is none.
+        Without the imbalance penalty, the layout with the most frequent key
+        on the best position and so on has the highest rating (rearrangement
+        inequality), and the penalty can only lower it.
+        """
+        if self.imbalance_penalty_factor < 0 or \
+                not self.has_linear_side_rating():
+            return None
+
+        keys_by_frequency = sorted(range(len(self.keys)),
+                                   key=lambda k: -self.frequency[k])
+        layout = best_order_of_side(keys_by_frequency,
+                                    self.left_keys_position_rating +
+                                    self.right_keys_position_rating)
+        return sum(self.rating_per_side(layout))
+
+    def anytime_search(self, budget, seed=0):
+        """
+        Yields (layout, rating result, gap, seconds) for every layout that is
+        better than the ones before, until budget seconds are over. The gap
+        is how much better than the layout the best one could be at most,
+        relative to rating_upper_bound (None without one).
+
+        It starts with the most frequent keys on the best positions and then
+        swaps keys as long as that improves the rating. Once no swap does, it
+        goes on from the best layout so far with a few random swaps.
+        """
+        start = time.monotonic()
+        deadline = start + budget
+        rng = random.Random(seed)
+        n = len(self.keys)
+        pairs = list(combinations(range(n), 2))
+        upper_bound = self.rating_upper_bound()
+
+        def improvement(layout, result):
+            gap = None
+            if upper_bound is not None:
+                gap = max(upper_bound - result.total, 0) / upper_bound
+            return layout, result, gap, time.monotonic() - start
+
+        keys_by_frequency = sorted(range(n), key=lambda k: -self.frequency[k])
+        layout = best_order_of_side(keys_by_frequency,
+                                    self.left_keys_position_rating +
+                                    self.right_keys_position_rating)
+        result = self.score(layout)
+        best, best_result = layout, result
+        yield improvement(best, best_result)
+
+        while True:
+            improved = False
+            for a, b in pairs:
+                if time.monotonic() >= deadline:
+                    return
+
+                swapped = bytearray(layout)
+                swapped[a], swapped[b] = swapped[b], swapped[a]
+                swapped = bytes(swapped)
+                swapped_result = self.score(swapped)
+                if swapped_result.total <= result.total:
+                    continue
+
+                layout, result = swapped, swapped_result
+                improved = True
+                if result.total > best_result.total:
+                    best, best_result = layout, result
+                    yield improvement(best, best_result)
+                    if upper_bound is not None and \
+                            best_result.total >= upper_bound:
+                        return  # nothing can be better
+
+            if not improved:
+                layout = bytearray(best)
+                for _ in range(rng.randint(2, 3)):
+                    a, b = rng.sample(range(n), 2)
+                    layout[a], layout[b] = layout[b], layout[a]
+                layout = bytes(layout)
+                result = self.score(layout)
+
+    def sweep_cache_key(self, count=10):
+        # everything the results of checking all permutations depend on
+        inputs = (self.current, self.frequency,
+                  self.left_keys_position_rating,
+                  self.right_keys_position_rating,
+                  self.imbalance_penalty_factor, count)
+        return hashlib.sha256(repr(inputs).encode()).hexdigest()
+
+    def load_sweep(self, cache_dir, count=10):
+        """
+        Returns the SweepResult stored for the same parameters in cache_dir,
+        or None if there is none.
+        """
+        path = os.path.join(cache_dir, f'{self.sweep_cache_key(count)}.json')
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        sweep = SweepResult(self, count)
+        try:
+            sweep.restore(data)
+        except KeyError:
+            return None  # stored before the distributions were
+
+        # so that it counts as recently used
+        os.utime(path)
+        return sweep
+
+    def store_sweep(self, cache_dir, sweep, max_size):
+        """
+        Stores sweep in cache_dir, after which the least recently used ones
+        are removed until they take up at most max_size bytes.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        key = self.sweep_cache_key(sweep.best.count)
+        path = os.path.join(cache_dir, f'{key}.json')
+        write_json_atomically(path, sweep.to_json())
+
+        # remove the least recently used results
+        paths = [os.path.join(cache_dir, name)
+                 for name in os.listdir(cache_dir) if name.endswith('.json')]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        size = 0
+        for path in paths:
+            size += os.path.getsize(path)
+            if size > max_size:
+                os.remove(path)
+
+    def store_partial_sweep(self, path, sweep, start_rank, end_rank):
+        """
+        Stores the results of checking the permutations with a rank from
+        start_rank up to end_rank in path, for merge_partial_sweeps.
+        """
+        data = {'parameters': self.sweep_cache_key(sweep.best.count),
+                'count': sweep.best.count,
+                'start_rank': start_rank,
+                'end_rank': end_rank,
+                'mirrored': sweep.mirrored,
+                'results': sweep.to_json()}
+        write_json_atomically(path, data)
+
+    def merge_partial_sweeps(self, paths):
+        """
+        Returns the merged SweepResult of the files from store_partial_sweep
+        and the ranges of ranks they cover, sorted. The ranges must not
+        overlap, and if they cover all permutations, the results are the same
+        as from checking all of them at once.
+        """
+        sweep = None
+        ranges = []
+        for path in paths:
+            with open(path) as f:
+                data = json.load(f)
+
+            if sweep is None:
+                count = data['count']
+                mirrored = data['mirrored']
+                sweep = SweepResult(self, count, mirrored)
+            if data['parameters'] != self.sweep_cache_key(count):
+                raise ValueError(f"{path} has results for other parameters")
+            if data['mirrored'] != mirrored:
+                # mirrored results also contain the mirrored versions of the
+                # permutations in their range
+                raise ValueError(f"only some of the results are mirrored, "
+                                 f"like {path}")
+
+            part = SweepResult(self, count)
+            part.restore(data['results'])
+            sweep.merge(part)
+            ranges.append((data['start_rank'], data['end_rank']))
+
+        ranges.sort()
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            if start < end:
+                raise ValueError(f"the ranks from {start} up to {end} were "
+                                 f"checked more than once")
+        return sweep, ranges
+
+    def table_path(self, cache_dir, suffix=''):
+        # everything the ratings of all permutations depend on
+        inputs = (self.current, self.frequency,
+                  self.left_keys_position_rating,
+                  self.right_keys_position_rating,
+                  self.imbalance_penalty_factor)
+        key = hashlib.sha256(repr(inputs).encode()).hexdigest()
+        return os.path.join(cache_dir, f'{key}{suffix}.npy')
+
+    def build_table(self, path):
+        """
+        Rates every permutation and writes the results to path, for
+        RatingTable (needs numpy).
+        """
+        import numpy as np
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        shape = (len(TABLE_COLUMNS), math.factorial(len(self.keys)))
+        table = np.lib.format.open_memmap(f'{path}.tmp', mode='w+',
+                                          dtype=np.float32, shape=shape)
+
+        # the blocks come in the order of the Lehmer rank
+        first = 0
+        for block in permutation_blocks(len(self.keys)):
+            rows = slice(first, first + len(block))
+            for column, values in enumerate(self.rate_block(block)):
+                table[column, rows] = values
+            first += len(block)
+
+        table.flush()
+        del table
+        os.replace(f'{path}.tmp', path)
+
+    def build_rank_index(self, path):
+        """
+        Rates every permutation and writes the sorted totals to path, for
+        RankIndex (needs numpy).
+        """
+        import numpy as np
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        totals = np.concatenate([
+                self.rate_block(block)[2]
+                for block in permutation_blocks(len(self.keys))])
+        totals = totals.astype(np.float32)
+        totals.sort()
+
+        # np.save would add .npy to the name
+        with open(f'{path}.tmp', 'wb') as f:
+            np.save(f, totals)
+        os.replace(f'{path}.tmp', path)
+
+
+class TopK:
+    """
+    Keeps the count items with the highest score in a min-heap, so adding is
+    O(log count). On equal scores the smaller key wins, which means the result
+    doesn't depend on the order the items were added in. Adding a key we
+    already keep again changes nothing.
+
+    >>> top = TopK(2)
+    >>> for key, score in [('c', 1), ('b', 3), ('a', 1), ('d', 2)]:
+    ...     top.add(key, score)
+    >>> top.items()
+    [('b', 3), ('d', 2)]
+    >>> top.add('a', 2)
+    >>> top.add('a', 2)
+    >>> top.items()
+    [('b', 3), ('a', 2)]
+    """
+
+    def __init__(self, count, lowest_score=-math.inf):
+        self.count = count
+
+        # items with a lower score than this can't be added anymore
+        self.threshold = lowest_score
+
+        # the worst item we keep is always at the top
+        self._heap = []
+        self._keys = set()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, key, score):
+        if score < self.threshold or key in self._keys:
+            return
+
+        item = (score, ReversedOrder(key))
+        if len(self._heap) < self.count:
+            heappush(self._heap, item)
+        elif self._heap[0] < item:
+            self._keys.remove(heapreplace(self._heap, item)[1].key)
+        else:
+            return
+        self._keys.add(key)
+
+        if len(self._heap) == self.count:
+            self.threshold = self._heap[0][0]
+
+    def merge(self, other):
+        for score, key in other._heap:
+            self.add(key.key, score)
+
+    def items(self):
+        """
+        Returns (key, score) tuples, best first.
+        """
+        best_first = sorted(self._heap, reverse=True)
+        return [(k.key, score) for score, k in best_first]
+
+    def best(self):
+        if not self._heap:
+            return None
+        return max(self._heap)[1].key
+
+
+class ReversedOrder:
+    # so that smaller keys count as better in TopK
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+class ParetoFrontier:
+    """
+    Keeps the layouts no other layout beats, i.e. there is none with at least
+    the same rating and steadiness but at most as many swaps (that isn't the
+    same in all three). Like with TopK, the result doesn't depend on the order
+    the layouts were added in, and adding one again changes nothing.
+
+    >>> frontier = ParetoFrontier()
+    >>> for key, rating, swaps, steadiness in [
+    ...         ('a', 3, 2, 1), ('b', 2, 1, 1), ('c', 1, 1, 2), ('d', 2, 2, 0),
+    ...         ('e', 3, 2, 1), ('f', 1, 1, 1), ('a', 3, 2, 1)]:
+    ...     frontier.add(key, rating, swaps, steadiness)
+    >>> frontier.items()
+    [('a', 3, 2, 1), ('e', 3, 2, 1), ('b', 2, 1, 1), ('c', 1, 1, 2)]
+    """
+
+    def __init__(self):
+        # swaps -> (negative rating, steadiness, key), sorted, so by
+        # decreasing rating and increasing steadiness
+        self._levels = {}
+
+        # swaps -> negative ratings of all layouts with at most that many swaps
+        # and the highest steadiness up to each one (for dominated)
+        self._staircases = {}
+
+    def __len__(self):
+        return sum(len(points) for points in self._levels.values())
+
+    def staircase(self, swaps):
+        if swaps not in self._staircases:
+            points = sorted(point for s, level in self._levels.items()
+                            if s <= swaps for point in level)
+            highest_steadiness = []
+            highest = -math.inf
+            for _, t, _ in points:
+                highest = max(highest, t)
+                highest_steadiness.append(highest)
+            self._staircases[swaps] = ([r for r, _, _ in points],
+                                       highest_steadiness)
+
+        return self._staircases[swaps]
+
+    def dominated(self, rating, swaps, steadiness):
+        neg_ratings, highest_steadiness = self.staircase(swaps)
+        i = bisect_right(neg_ratings, -rating)
+        if not i or highest_steadiness[i - 1] < steadiness:
+            return False
+        if highest_steadiness[i - 1] > steadiness:
+            return True
+
+        # layouts that are the same in all three don't beat each other
+        return any(-r >= rating and t >= steadiness and
+                   (-r > rating or t > steadiness or s < swaps)
+                   for s, level in self._levels.items() if s <= swaps
+                   for r, t, _ in level)
+
+    def add(self, key, rating, swaps, steadiness):
+        if self.dominated(rating, swaps, steadiness):
+            return
+
+        point = (-rating, steadiness, key)
+        level = self._levels.get(swaps, [])
+        i = bisect_left(level, point)
+        if i < len(level) and level[i] == point:
+            return
+
+        # remove the ones the new layout beats
+        for s, level in self._levels.items():
+            if s < swaps:
+                continue
+            i = bisect_left(level, (-rating,))
+            while i < len(level) and level[i][1] <= steadiness:
+                if s == swaps and level[i][:2] == (-rating, steadiness):
+                    i += 1
+                else:
+                    del level[i]
+
+        insort(self._levels.setdefault(swaps, []), point)
+        self._staircases.clear()
+
+    def merge(self, other):
+        for item in other.items():
+            self.add(*item)
+
+    def items(self):
+        """
+        Returns (key, rating, swaps, steadiness) tuples, best rating first.
+        """
+        return sorted(((key, -r, s, t) for s, level in self._levels.items()
+                       for r, t, key in level),
+                      key=lambda item: (-item[1], item[2], -item[3], item[0]))
+
+
+class Distribution:
+    """
+    A histogram of one rating, with a fixed number of bins between low and
+    high, so it takes the same memory however many values are added. It also
+    counts how many values are between each pair of the ascending thresholds.
+    Like the other results, it doesn't depend on the order of the values and
+    can be merged.
+
+    >>> distribution = Distribution(0, 10, bins=10, thresholds=[2, 5])
+    >>> for value in [1, 2, 2.5, 3, 9]:
+    ...     distribution.add(value)
+    >>> distribution.quantile(0.5), distribution.above(2)
+    (2.75, 3)
+    """
+
+    def __init__(self, low, high, bins=DISTRIBUTION_BINS, thresholds=()):
+        self.low = low
+        self.high = high
+        self.scale = bins / (high - low)
+        self.counts = [0] * bins
+        self.thresholds = list(thresholds)
+
+        # how many values are above none, one, ... of the thresholds (if
+        # there are any)
+        self.between = [0] * (len(self.thresholds) + 1)
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def bin(self, value):
+        i = int((value - self.low) * self.scale)
+        return min(max(i, 0), len(self.counts) - 1)
+
+    def add(self, value, times=1):
+        self.counts[self.bin(value)] += times
+        if self.thresholds:
+            self.between[bisect_left(self.thresholds, value)] += times
+
+    def add_array(self, values, times=1):
+        # the same as adding each value of the numpy array
+        import numpy as np
+
+        bins = ((values - self.low) * self.scale).astype(np.intp)
+        np.clip(bins, 0, len(self.counts) - 1, out=bins)
+        counts = np.bincount(bins, minlength=len(self.counts))
+        self.counts = [a + int(b) * times
+                       for a, b in zip(self.counts, counts)]
+
+        if self.thresholds:
+            between = np.bincount(np.searchsorted(self.thresholds, values),
+                                  minlength=len(self.between))
+            self.between = [a + int(b) * times
+                            for a, b in zip(self.between, between)]
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.between = [a + b for a, b in zip(self.between, other.between)]
+
+    def above(self, threshold):
+        return sum(self.between[self.thresholds.index(threshold) + 1:])
+
+    def quantile(self, q):
+        # interpolated within the bin, so off by at most the width of one
+        target = q * len(self)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                return self.low + (i + (target - seen) / count) / self.scale
+            seen += count
+        return self.high
+
+    def to_json(self):
+        return {'low': self.low, 'high': self.high,
+                'thresholds': self.thresholds, 'counts': self.counts,
+                'between': self.between}
+
+    def restore(self, data):
+        # from to_json, for the same low, high, bins and thresholds
+        self.counts = data['counts']
+        self.between = data['between']
+
+
+class SweepResult:
+    """
+    Keeps track of the permutations we report after checking all of them.
+    Results for different parts of all permutations can be merged.
+
+    If mirrored, the mirrored version of every permutation that is added (or
+    tallied) is added too, with the same ratings.
+    """
+
+    def __init__(self, optimizer, count=10, mirrored=False):
+        self.optimizer = optimizer
+        self.mirrored = mirrored
+
+        self.best = TopK(count)
+
+        # the score is the negative rating
+        self.worst = TopK(1)
+
+        # the score is (negative side frequency delta, rating)
+        self.most_balanced = TopK(1, lowest_score=(-math.inf,))
+
+        # trade-offs between rating, swaps from current and steadiness
+        self.frontier = ParetoFrontier()
+
+        # of all permutations, unlike the others
+        self.distributions = optimizer.rating_distributions()
+
+    def add(self, p, result, frequency_delta=None, swaps=None):
+        # frequency_delta and swaps are only computed if needed, unless the
+        # caller already knows them
+        if self.mirrored:
+            # the frequency delta doesn't change, but the swaps do
+            mirrored_result = RatingResult(result.right, result.left,
+                                           result.total,
+                                           result.imbalance_penalty)
+            self.add_one(p[::-1], mirrored_result, frequency_delta)
+        self.add_one(p, result, frequency_delta, swaps)
+
+    def could_change(self, p, result):
+        """
+        Returns False if adding p (and its mirrored version) can't change
+        anything, only by checking what's cheap: the ratings, the frequency
+        delta, and whether the frontier has something at least as good with
+        the fewest swaps p could need and the highest steadiness it could
+        have. Every swap moves at most two keys into their current position.
+        """
+        rating = result.total
+        if rating >= self.best.threshold or -rating >= self.worst.threshold:
+            return True
+
+        optimizer = self.optimizer
+        if -optimizer.side_frequency_delta(p) >= \
+                self.most_balanced.threshold[0]:
+            return True
+
+        n = len(p)
+        current_layout = optimizer.current_layout
+        highest_same_side_score = \
+            2 * sum(optimizer.frequency) * (1 + RATING_TOLERANCE)
+        for layout in (p, p[::-1]) if self.mirrored else (p,):
+            same_position_count = sum(
+                    k == ck for k, ck in zip(layout, current_layout))
+            if not self.frontier.dominated(
+                    rating, (n - same_position_count + 1) // 2,
+                    same_position_count + highest_same_side_score):
+                return True
+        return False
+
+    def add_one(self, p, result, frequency_delta=None, swaps=None):
+        rating = result.total
+
+        self.best.add(p, rating)
+        self.worst.add(p, -rating)
+
+        # there will be many "most balanced" permutations, since the imbalance
+        # penalty does not consider positions, only sides
+        if frequency_delta is None:
+            frequency_delta = self.optimizer.side_frequency_delta(p)
+        if -frequency_delta >= self.most_balanced.threshold[0]:
+            self.most_balanced.add(p, (-frequency_delta, rating))
+
+        if swaps is None:
+            swaps = self.optimizer.count_swaps(p)
+        self.frontier.add(p, rating, swaps,
+                          self.optimizer.steadiness_score(p))
+
+    def tally(self, result):
+        # Adds the ratings of a permutation to the distributions. Unlike add,
+        # this has to be called for every permutation.
+        distributions = self.distributions
+        distributions['left'].add(result.left)
+        distributions['right'].add(result.right)
+        times = 1
+        if self.mirrored:
+            # the sides swap their ratings
+            distributions['left'].add(result.right)
+            distributions['right'].add(result.left)
+            times = 2
+        distributions['total'].add(result.total, times)
+        distributions['imbalance_penalty'].add(result.imbalance_penalty,
+                                               times)
+
+    def tally_block(self, left, right, total, imbalance_penalty):
+        # the same as tally, for numpy arrays
+        distributions = self.distributions
+        distributions['left'].add_array(left)
+        distributions['right'].add_array(right)
+        times = 1
+        if self.mirrored:
+            distributions['left'].add_array(right)
+            distributions['right'].add_array(left)
+            times = 2
+        distributions['total'].add_array(total, times)
+        distributions['imbalance_penalty'].add_array(imbalance_penalty,
+                                                     times)
+
+    def to_json(self):
+        optimizer = self.optimizer
+        data = {name: [(optimizer.layout_str(layout), score)
+                       for layout, score in getattr(self, name).items()]
+                for name in ('best', 'worst', 'most_balanced')}
+        data['frontier'] = [(optimizer.layout_str(layout), rating, swaps,
+                             steadiness)
+                            for layout, rating, swaps, steadiness
+                            in self.frontier.items()]
+        data['distributions'] = {name: distribution.to_json()
+                                 for name, distribution
+                                 in self.distributions.items()}
+        return data
+
+    def restore(self, data):
+        # from to_json, for the same optimizer and count
+        optimizer = self.optimizer
+        for name in ('best', 'worst', 'most_balanced'):
+            top = getattr(self, name)
+            for layout, score in data[name]:
+                top.add(optimizer.to_layout(layout),
+                        tuple(score) if isinstance(score, list) else score)
+        for layout, rating, swaps, steadiness in data['frontier']:
+            self.frontier.add(optimizer.to_layout(layout), rating, swaps,
+                              steadiness)
+        for name, distribution in data['distributions'].items():
+            self.distributions[name].restore(distribution)
+
+    def merge(self, other):
+        self.best.merge(other.best)
+        self.worst.merge(other.worst)
+        self.most_balanced.merge(other.most_balanced)
+        self.frontier.merge(other.frontier)
+        for name, distribution in self.distributions.items():
+            distribution.merge(other.distributions[name])
+
+    def stats(self):
+        """
+        Returns the distribution of each rating and how many permutations are
+        better than current by more than each of BETTER_THAN_CURRENT_BY
+        percent, for writing them as JSON.
+        """
+        quantiles = (0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99)
+        total = self.distributions['total']
+        return {
+            'permutations': len(total),
+            'current': self.optimizer.current_rating,
+            'better_than_current_by': {
+                f'{percent}%': total.above(threshold)
+                for percent, threshold
+                in zip(BETTER_THAN_CURRENT_BY, total.thresholds)},
+            'distributions': {
+                name: {'quantiles': {str(q): distribution.quantile(q)
+                                     for q in quantiles},
+                       'histogram': {'low': distribution.low,
+                                     'high': distribution.high,
+                                     'counts': distribution.counts}}
+                for name, distribution in self.distributions.items()}}
+
+
+class SweepProgress:
+    """
+    How many of total permutations were checked so far and how long each
+    phase of checking them took. The engines add to it in batches instead of
+    timing every permutation. If report is given, it is called with the
+    progress at most every interval seconds.
+    """
+
+    def __init__(self, total, interval=10, report=None):
+        self.total = total
+        self.done = 0
+
+        # phase -> seconds
+        self.phases = {}
+
+        self.interval = interval
+        self.report = report
+        self.start = time.perf_counter()
+        self._next_report = self.start + interval
+
+    def add(self, count, phases=None):
+        self.done += count
+        for phase, seconds in (phases or {}).items():
+            self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+        if self.report is not None:
+            now = time.perf_counter()
+            if now >= self._next_report:
+                self._next_report = now + self.interval
+                self.report(self)
+
+    def add_sampled(self, count, seconds, sample):
+        # the phases took seconds in all, split up like in sample
+        sampled = sum(sample.values())
+        if not sampled:
+            self.add(count)
+            return
+        self.add(count, {phase: seconds * phase_seconds / sampled
+                         for phase, phase_seconds in sample.items()})
+
+    def seconds(self):
+        return time.perf_counter() - self.start
+
+    def per_second(self):
+        return self.done / self.seconds()
+
+    def seconds_left(self):
+        per_second = self.per_second()
+        if not per_second:
+            return None
+        return (self.total - self.done) / per_second
+
+    def stats(self):
+        """
+        Returns the progress as a dict, for writing it as JSON.
+        """
+        return {'permutations': self.done,
+                'total': self.total,
+                'percent': 100 * self.done / self.total if self.total else 100,
+                'seconds': self.seconds(),
+                'per_second': self.per_second(),
+                'seconds_left': self.seconds_left(),
+                'phases': self.phases}
+
+    def __str__(self):
+        def number(n):
+            return f"{round(n):,}".replace(',', ' ')
+
+        text = (f"checked {number(self.done)} of {number(self.total)} "
+                f"permutations ({self.stats()['percent']:.1f}%) in "
+                f"{self.seconds():.1f} s, {number(self.per_second())} per "
+                f"second")
+        seconds_left = self.seconds_left()
+        if self.done < self.total and seconds_left is not None:
+            text += f", about {seconds_left:.0f} s left"
+        return text
+
+
+class Constraints:
+    """
+    Which layouts are allowed. Keys are given as characters of current.
+
+    >>> optimizer = Optimizer(Config())
+    >>> constraints = Constraints(pinned={'0': 9},
+    ...                           forbidden={'1': optimizer.pinky_positions},
+    ...                           max_hand_changes=2)
+    >>> constraints.allows(optimizer, optimizer.to_layout('23145 67890'))
+    True
+    >>> constraints.allows(optimizer, optimizer.to_layout('12345 67890'))
+    False
+    >>> constraints.allows(optimizer, optimizer.to_layout('23145 67809'))
+    False
+    >>> constraints.allows(optimizer, optimizer.to_layout('67145 23890'))
+    False
+    """
+
+    def __init__(self, keep_sides=False, pinned=None, forbidden=None,
+                 max_hand_changes=None):
+        self.keep_sides = keep_sides
+
+        # key -> position and key -> positions
+        self.pinned = pinned or {}
+        self.forbidden = forbidden or {}
+
+        # how many keys may end up on the other side than in current
+        self.max_hand_changes = max_hand_changes
+
+    def allowed_positions(self, optimizer):
+        # the set of positions for every key of the optimizer
+        n = len(optimizer.keys)
+        n_left = optimizer.n_left
+        allowed = [set(range(n)) for _ in range(n)]
+
+        if self.keep_sides:
+            for k in range(n):
+                if optimizer.is_left_key[k]:
+                    allowed[k] -= set(range(n_left, n))
+                else:
+                    allowed[k] -= set(range(n_left))
+
+        for key, positions in self.forbidden.items():
+            allowed[optimizer.key_index(key)] -= set(positions)
+
+        for key, pos in self.pinned.items():
+            allowed[optimizer.key_index(key)] &= {pos}
+
+        return allowed
+
+    def allows(self, optimizer, layout):
+        allowed = self.allowed_positions(optimizer)
+        if any(pos not in allowed[k] for pos, k in enumerate(layout)):
+            return False
+
+        return (self.max_hand_changes is None or
+                optimizer.hand_changes(layout) <= self.max_hand_changes)
+
+    def allowed_rows(self, optimizer, block):
+        # same as allows, for every row of a block of layouts at once
+        import numpy as np
+
+        n = len(optimizer.keys)
+        allowed = np.zeros((n, n), dtype=bool)
+        for k, positions in enumerate(self.allowed_positions(optimizer)):
+            allowed[k, list(positions)] = True
+
+        # one position at a time is a lot faster than all at once
+        rows = np.ones(len(block), dtype=bool)
+        for pos in range(n):
+            if not allowed[:, pos].all():
+                rows &= allowed[block[:, pos], pos]
+
+        if self.max_hand_changes is not None:
+            is_left_key = np.array(optimizer.is_left_key)
+            hand_changes = np.zeros(len(block), dtype=np.intp)
+            for pos in range(n):
+                hand_changes += is_left_key[block[:, pos]] != \
+                    (pos < optimizer.n_left)
+            rows &= hand_changes <= self.max_hand_changes
+
+        return rows
+
+
+class RatingTable:
+    """
+    The ratings of every permutation, as written by Optimizer.build_table.
+    There is a float32 column for each of TABLE_COLUMNS, with the row of each
+    layout at its Lehmer rank. The file is memory-mapped read-only, so it's
+    only read as far as needed and all processes using it share it.
+    """
+
+    def __init__(self, optimizer, path):
+        import numpy as np
+
+        self.optimizer = optimizer
+        self.columns = np.load(path, mmap_mode='r')
+
+        n = len(optimizer.keys)
+        if self.columns.shape != (len(TABLE_COLUMNS), math.factorial(n)) or \
+                self.columns.dtype != np.float32:
+            raise ValueError(f"{path} is not a rating table for {n} keys")
+
+    def result(self, layout):
+        # only about 7 significant digits, use Optimizer.score for all of them
+        return RatingResult(*(float(value) for value
+                              in self.columns[:, lehmer_rank(layout)]))
+
+    def top(self, count=10, constraints=None, worst=False):
+        """
+        Returns the count best (or worst) layouts the constraints allow and
+        their rating, best (or worst) first.
+        """
+        import numpy as np
+
+        optimizer = self.optimizer
+        n = len(optimizer.keys)
+        sign = -1 if worst else 1
+        total = sign * self.columns[TABLE_COLUMNS.index('total')]
+
+        if constraints is not None:
+            allowed = np.concatenate([
+                    constraints.allowed_rows(optimizer, block)
+                    for block in permutation_blocks(n)])
+            total = np.where(allowed, total, -np.inf)
+
+        kth_best = total.min()
+        if count < len(total):
+            kth_best = -np.partition(-total, count - 1)[count - 1]
+
+        # The float32 ratings might be a bit off, so the exact ones decide
+        # between those that are close. They are the same as from checking
+        # all permutations.
+        candidates = np.flatnonzero((total >= kth_best - abs(kth_best) * 1e-6)
+                                    & (total > -np.inf))
+        best = TopK(count)
+        for rank in candidates:
+            layout = lehmer_unrank(int(rank), n)
+            best.add(layout, sign * optimizer.score(layout).total)
+
+        return [(layout, sign * rating) for layout, rating in best.items()]
+
+
+class RankIndex:
+    """
+    Where layouts fall among all permutations, from the sorted totals written
+    by Optimizer.build_rank_index. They are float32, so ratings that only
+    differ by about one in ten million count as the same.
+
+    The rank is one more than the number of permutations with a higher
+    rating, so the best ones have rank 1, and the percentile is the share of
+    all permutations that have the same or a lower rating.
+    """
+
+    def __init__(self, optimizer, path):
+        import numpy as np
+
+        self.optimizer = optimizer
+        self.totals = np.load(path, mmap_mode='r')
+
+        n = len(optimizer.keys)
+        if self.totals.shape != (math.factorial(n),) or \
+                self.totals.dtype != np.float32:
+            raise ValueError(f"{path} is not a rank index for {n} keys")
+
+    def rank(self, layout):
+        return len(self.totals) - self.at_most_as_good_as(layout) + 1
+
+    def percentile(self, layout):
+        return 100 * self.at_most_as_good_as(layout) / len(self.totals)
+
+    def at_most_as_good_as(self, layout):
+        # how many permutations have the same or a lower rating
+        import numpy as np
+
+        total = np.float32(self.optimizer.score(layout).total)
+        return int(np.searchsorted(self.totals, total, 'right'))
+
+    def ranks(self, layouts):
+        # for many layouts at once, as an array
+        return len(self.totals) - self.at_most_as_good(layouts) + 1
+
+    def percentiles(self, layouts):
+        return 100 * self.at_most_as_good(layouts) / len(self.totals)
+
+    def at_most_as_good(self, layouts):
+        # same as at_most_as_good_as, for many layouts at once
+        import numpy as np
+
+        n = len(self.optimizer.keys)
+        block = np.frombuffer(b''.join(layouts), dtype=np.uint8)
+        totals = self.optimizer.rate_block(block.reshape(-1, n))[2]
+        return np.searchsorted(self.totals, totals.astype(np.float32),
+                               'right')
+
+
+def write_json_atomically(path, data):
+    # Others only ever see the complete file. The temporary file is our own,
+    # even if another process on another host writes the same path (e.g. two
+    # workers that both think they have the same shard).
+    tmp_path = f'{path}.{socket.gethostname()}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+# the optimizer of this process if it's one of the workers of
+# Optimizer.check_all_permutations_in_parallel, see init_worker
+_worker_optimizer = None
+
+
+def init_worker(optimizer, n_permutations):
+    # The optimizer is only sent to every worker once instead of with every
+    # prefix, and its side tables are built once for all of them if it
+    # checks at least n_permutations.
+    global _worker_optimizer
+    _worker_optimizer = optimizer
+    optimizer.build_side_tables_for(n_permutations)
+
+
+def check_prefix_in_worker(check_all, prefix, **kwargs):
+    # calls the check_all_permutations method named check_all of the
+    # optimizer of the worker
+    return getattr(_worker_optimizer, check_all)(prefix, **kwargs)
+
+
+def lehmer_rank(layout):
+    """
+    Returns the position of layout among all permutations of range(n) in the
+    order of itertools.permutations.
+
+    >>> lehmer_rank(bytes([0, 1, 2])), lehmer_rank(bytes([1, 2, 0]))
+    (0, 3)
+    >>> list(lehmer_unrank(3, 3))
+    [1, 2, 0]
+    """
+    n = len(layout)
+    rank = 0
+    for i, k in enumerate(layout):
+        smaller_after = sum(other < k for other in layout[i + 1:])
+        rank += smaller_after * math.factorial(n - 1 - i)
+    return rank
+
+
+def lehmer_unrank(rank, n):
+    keys = list(range(n))
+    layout = []
+    for i in range(n - 1, -1, -1):
+        index, rank = divmod(rank, math.factorial(i))
+        layout.append(keys.pop(index))
+    return bytes(layout)
+
+
+def rank_prefixes(n, start=0, end=None, min_length=0):
+    """
+    Yields the prefixes of the permutations of range(n) with a rank from start
+    up to end (all by default), in the order of their ranks. Every permutation
+    starting with one of them is in this range. Prefixes shorter than
+    min_length are split into longer ones.
+
+    >>> list(rank_prefixes(3, 1, 5))
+    [(0, 2), (1,), (2, 0)]
+    >>> list(rank_prefixes(3, min_length=1))
+    [(0,), (1,), (2,)]
+    """
+    if end is None:
+        end = math.factorial(n)
+
+    def prefixes(prefix, rest, first_rank):
+        size = math.factorial(len(rest))
+        if first_rank >= end or first_rank + size <= start:
+            return
+        if start <= first_rank and first_rank + size <= end and \
+                len(prefix) >= min_length:
+            yield prefix
+            return
+
+        size //= len(rest)
+        for i, k in enumerate(rest):
+            yield from prefixes(prefix + (k,), rest[:i] + rest[i + 1:],
+                                first_rank + i * size)
+
+    yield from prefixes((), tuple(range(n)), 0)
+
+
+def n_checked_with_prefix(n, prefix, mirrored):
+    """
+    Returns how many of the permutations of range(n) starting with prefix
+    are rated, which is only the ones with a smaller first than last key if
+    mirrored.
+
+    >>> n_checked_with_prefix(4, (1,), True)
+    4
+    """
+    rest = n - len(prefix)
+    if not mirrored:
+        return math.factorial(rest)
+    if not prefix:
+        return math.factorial(n) // 2
+    if not rest:
+        return int(prefix[0] < prefix[-1])
+
+    # each of the other keys is the last one equally often
+    larger = sum(k > prefix[0] for k in range(n) if k not in prefix)
+    return larger * math.factorial(rest - 1)
+
+
+def permutations_by_rank(n, start=0, end=None):
+    """
+    Yields the permutations of range(n) with a rank from start up to end as
+    bytes, in the order of itertools.permutations.
+
+    >>> [list(p) for p in permutations_by_rank(3, 2, 4)]
+    [[1, 0, 2], [1, 2, 0]]
+    """
+    for prefix in rank_prefixes(n, start, end):
+        rest = [k for k in range(n) if k not in prefix]
+        for p in permutations(rest):
+            yield bytes(prefix + p)
+
+
+def best_order_of_side(keys_by_frequency, rating):
+    # most frequent key on the best position and so on
+    positions = sorted(range(len(rating)), key=lambda pos: -rating[pos])
+    order = [0] * len(rating)
+    for pos, k in zip(positions, keys_by_frequency):
+        order[pos] = k
+    return bytes(order)
+
+
+def swap_cycles(positions, max_swaps):
+    if not positions or max_swaps == 0:
+        yield []
+        return
+
+    first, rest = positions[0], positions[1:]
+
+    # the first position stays where it is
+    yield from swap_cycles(rest, max_swaps)
+
+    # or it starts a cycle with others, which needs one swap per other one
+    for length in range(1, min(max_swaps, len(rest)) + 1):
+        for others in permutations(rest, length):
+            remaining = tuple(pos for pos in rest if pos not in others)
+            for cycles in swap_cycles(remaining, max_swaps - length):
+                yield [(first,) + others] + cycles
+
+
+@lru_cache(maxsize=None)
+def permutations_array(n):
+    import numpy as np
+
+    return np.array(list(permutations(range(n))), dtype=np.uint8)
+
+
+def permutation_blocks(n, prefix=()):
+    """
+    Yields all permutations of range(n) that start with prefix as rows of
+    uint8 arrays, in the same order as itertools.permutations. Each block
+    shares the first n - 8 items (or the whole prefix, if that is longer).
+    """
+    import numpy as np
+
+    block_prefix_length = max(n - 8, len(prefix))
+    tail = permutations_array(n - block_prefix_length)
+    rest = [i for i in range(n) if i not in prefix]
+
+    for middle in permutations(rest, block_prefix_length - len(prefix)):
+        block_prefix = prefix + middle
+        block_rest = np.array([i for i in rest if i not in middle],
+                              dtype=np.uint8)
+
+        block = np.empty((len(tail), n), dtype=np.uint8)
+        block[:, :block_prefix_length] = block_prefix
+        block[:, block_prefix_length:] = block_rest[tail]
+        yield block
+
+
+def swap_counts(block, target_position):
+    # Sorting a permutation by swaps needs (length - number of cycles) swaps.
+    # A position starts a cycle if it's the smallest one in it.
+    import numpy as np
+
+    n = block.shape[1]
+    sigma = target_position[block]
+    row_offsets = np.arange(0, sigma.size, n).reshape(-1, 1)
+    flat_sigma = (sigma + row_offsets).ravel()
+    positions = np.arange(n)
+
+    smallest = np.minimum(sigma, positions)
+    following = flat_sigma
+    for _ in range(n - 2):
+        following = flat_sigma[following]
+        np.minimum(smallest, following.reshape(-1, n) - row_offsets,
+                   out=smallest)
+
+    cycles = np.count_nonzero(smallest == positions, axis=1)
+    return n - cycles
+
+
+def not_dominated(frontier, total, swaps, steadiness):
+    # same as ParetoFrontier.dominated, but for whole arrays and a bit
+    # generous, as the ratings and steadiness here might be slightly off
+    import numpy as np
+
+    margin = 1e-6
+    result = np.ones(len(total), dtype=bool)
+    for s in np.flatnonzero(np.bincount(swaps)):
+        rows = swaps == s
+        neg_ratings, highest_steadiness = frontier.staircase(int(s))
+        i = np.searchsorted(neg_ratings, -(total[rows] + margin), 'right')
+        highest_steadiness = np.array([-np.inf] + highest_steadiness)
+        result[rows] = highest_steadiness[i] < steadiness[rows] + margin
+    return result
+
+
+def pareto_rows(total, swaps, steadiness):
+    # the rows no other one clearly beats, which leaves only a few for adding
+    # them to the frontier one by one
+    import numpy as np
+
+    margin = 1e-6
+    order = np.argsort(-total, kind='stable')
+    higher_rated_count = np.searchsorted(-total[order], -(total + margin),
+                                         'left')
+
+    result = np.ones(len(total), dtype=bool)
+    for s in np.flatnonzero(np.bincount(swaps)):
+        rows = swaps == s
+        highest_steadiness = np.maximum.accumulate(
+                np.where(swaps[order] <= s, steadiness[order], -np.inf))
+        highest_steadiness = np.concatenate([[-np.inf], highest_steadiness])
+        result[rows] = (highest_steadiness[higher_rated_count[rows]] <=
+                        steadiness[rows] + margin)
+    return result
+
+
+def rate_block_for_parameter_sets(block, optimizers):
+    # Returns the ratings of all rows for every optimizer at once. They all
+    # need the same keys on each side. Like in check_all_permutations_numpy,
+    # the sums are done in the same order as in Optimizer.score, so each row
+    # gets the same rating as from the optimizer itself.
+    import numpy as np
+
+    for optimizer in optimizers:
+        optimizer.require_linear_side_rating("rating parameter sets at once")
+
+    n_left = optimizers[0].n_left
+    n_right = len(optimizers[0].right)
+    frequency, rating, max_delta, penalty_factor = (
+            np.array(values) for values in zip(*(
+                (o.frequency,
+                 o.left_keys_position_rating + o.right_keys_position_rating,
+                 o.max_frequency_delta_between_sides,
+                 o.imbalance_penalty_factor) for o in optimizers)))
+    rating = rating[:, :, np.newaxis]
+    max_delta = max_delta[:, np.newaxis]
+    penalty_factor = penalty_factor[:, np.newaxis]
+
+    # parameter set, row, position
+    f = frequency[:, block]
+
+    left = rating[:, 0] * f[:, :, 0]
+    left_frequency = f[:, :, 0].copy()
+    for pos in range(1, n_left):
+        left += rating[:, pos] * f[:, :, pos]
+        left_frequency += f[:, :, pos]
+
+    right = rating[:, n_left] * f[:, :, n_left]
+    right_frequency = f[:, :, n_left].copy()
+    for pos in range(n_left + 1, n_left + n_right):
+        right += rating[:, pos] * f[:, :, pos]
+        right_frequency += f[:, :, pos]
+
+    total = left + right
+    norm_frequency_delta = np.abs(left_frequency / n_left -
+                                  right_frequency / n_right)
+    norm_frequency_delta /= max_delta
+    imbalance_penalty = total * norm_frequency_delta
+    imbalance_penalty *= penalty_factor
+    if optimizers[0].fixed_point:
+        imbalance_penalty = to_fixed_point(imbalance_penalty,
+                                           2 * FIXED_POINT_BITS)
+    total -= imbalance_penalty
+    return total
+
+
+def check_all_parameter_sets(optimizers, count):
+    """
+    Returns the best count permutations (with their rating) for each of the
+    optimizers, after going through all of them once.
+    """
+    import numpy as np
+
+    best = [TopK(count) for _ in optimizers]
+
+    # there is an array as large as the block for every optimizer, so not too
+    # many are rated at once
+    chunk_size = 16
+
+    for block in permutation_blocks(len(optimizers[0].keys)):
+        for first in range(0, len(optimizers), chunk_size):
+            chunk = slice(first, first + chunk_size)
+            totals = rate_block_for_parameter_sets(block, optimizers[chunk])
+
+            for top, total in zip(best[chunk], totals):
+                rows = np.flatnonzero(total >= top.threshold)
+                if len(rows) > count:
+                    best_ratings = total[rows]
+                    kth_best_rating = -np.partition(-best_ratings,
+                                                    count - 1)[count - 1]
+                    rows = rows[best_ratings >= kth_best_rating]
+
+                for i in rows:
+                    top.add(block[i].tobytes(), float(total[i]))
+
+    return [top.items() for top in best]
@@ -0,0 +1,366 @@
+"""
+Checks all permutations for one or more parameter sets on several hosts that
+share a directory (e.g. over NFS), with any number of workers on each:
+
+    python run_shards.py plan DIR --grid 'ZIPF_FACTOR=[0.4, 0.6, 0.8]'
+    python run_shards.py work DIR --processes 4     (on every host)
+    python run_shards.py merge DIR
+
+plan splits the permutations of each parameter set (the ones configured in
+find_optimal_num_rows.py, changed by --grid) into shards of ranks and writes
+them to DIR/manifest.json. Workers claim shards with lock files in DIR/locks
+and write the results of each to DIR/results. While a worker checks a shard,
+it keeps touching its lock. If it dies, the lock becomes stale and the shard
+is claimed again, so only that shard has to be checked again. merge shows
+the merged results of every parameter set and caches the complete ones like
+find_optimal_num_rows.py does.
+"""
+import argparse
+import json
+import math
+import os
+import socket
+import threading
+import time
+
+from find_optimal_num_rows import (BEST_PERMUTATIONS_COUNT, CACHE_DIR,
+                                   CACHE_MAX_SIZE, SWEEP_ENGINE,
+                                   configured_optimizer, count_to_collect,
+                                   grid_optimizers, grid_parameter,
+                                   print_sweep)
+from num_row_optimizer import SWEEP_ENGINES, Config, Optimizer
+
+# Needs at least Python 3.8
+
+# How many shards plan splits the permutations of each parameter set into.
+# Each worker only loses the shard it was checking when it dies.
+SHARDS_PER_PARAMETER_SET = 100
+
+# A lock that wasn't touched for this many seconds belongs to a worker that
+# died. Workers on the same host notice that right away.
+STALE_AFTER = 600
+
+
+class ShardDirectory:
+    """
+    The manifest, locks and results in a directory all workers share.
+
+    >>> import shutil, subprocess, sys, tempfile
+    >>> directory = ShardDirectory(tempfile.mkdtemp())
+    >>> optimizer = Optimizer(Config(
+    ...         current='1234 5678',
+    ...         left_keys_position_rating=[0.55, 0.8, 1, 0.98]))
+    >>> directory.plan([optimizer], [{}], 10, shards=4)
+    >>> first, second = directory.manifest()['shards'][:2]
+
+    A worker on this host died while checking the first shard, and one on
+    another host died while writing the lock of the second one:
+
+    >>> dead = subprocess.run(
+    ...         [sys.executable, '-c', 'import os; print(os.getpid())'],
+    ...         capture_output=True, text=True)
+    >>> with open(os.path.join(directory.locks,
+    ...                        f"{first['name']}.0.lock"), 'w') as f:
+    ...     json.dump({'host': socket.gethostname(),
+    ...                'pid': int(dead.stdout)}, f)
+    >>> lock = os.path.join(directory.locks, f"{second['name']}.0.lock")
+    >>> with open(lock, 'w') as f:
+    ...     _ = f.write('{"host": ')
+    >>> os.utime(lock, (0, 0))
+
+    Two workers still check every shard once, and merging them gives the
+    same as checking all permutations at once:
+
+    >>> from concurrent.futures import ProcessPoolExecutor
+    >>> with ProcessPoolExecutor(2) as executor:
+    ...     sum(executor.map(work_in_process, [directory.path] * 2,
+    ...                      ['loop'] * 2, [STALE_AFTER] * 2))
+    4
+    >>> [os.path.exists(os.path.join(directory.locks,
+    ...                               f"{shard['name']}.1.lock"))
+    ...  for shard in (first, second)]
+    [True, True]
+    >>> [(parameters, sweep.best.items() == optimizer.sweep().best.items(),
+    ...   missing) for parameters, _, sweep, missing in directory.merge()]
+    [({}, True, [])]
+    >>> shutil.rmtree(directory.path)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        self.locks = os.path.join(path, 'locks')
+        self.results = os.path.join(path, 'results')
+        self._manifest = None
+
+    def plan(self, optimizers, parameter_sets, count,
+             shards=SHARDS_PER_PARAMETER_SET):
+        """
+        Writes the manifest, with the ranks of the permutations of each
+        optimizer split into shards.
+        """
+        if os.path.exists(self.manifest_path):
+            raise ValueError(f"{self.manifest_path} already exists")
+
+        manifest = {'count': count, 'parameter_sets': {}, 'shards': []}
+        for optimizer, parameters in zip(optimizers, parameter_sets):
+            key = optimizer.sweep_cache_key(count)
+            manifest['parameter_sets'][key] = {
+                    'parameters': parameters,
+                    'config': vars(optimizer.config)}
+
+            n_permutations = math.factorial(len(optimizer.keys))
+            n_shards = min(shards, n_permutations)
+            ranks = [n_permutations * i // n_shards
+                     for i in range(n_shards + 1)]
+            manifest['shards'] += [
+                    {'name': f'{key[:16]}-{i:04}', 'parameter_set': key,
+                     'start_rank': start, 'end_rank': end}
+                    for i, (start, end) in enumerate(zip(ranks, ranks[1:]))]
+
+        os.makedirs(self.locks, exist_ok=True)
+        os.makedirs(self.results, exist_ok=True)
+        with open(f'{self.manifest_path}.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(f'{self.manifest_path}.tmp', self.manifest_path)
+
+    def manifest(self):
+        if self._manifest is None:
+            with open(self.manifest_path) as f:
+                self._manifest = json.load(f)
+        return self._manifest
+
+    def optimizer(self, key):
+        config = self.manifest()['parameter_sets'][key]['config']
+        return Optimizer(Config(**config))
+
+    def result_path(self, shard):
+        return os.path.join(self.results, f"{shard['name']}.json")
+
+    def done(self, shard):
+        return os.path.exists(self.result_path(shard))
+
+    def claim(self, shard, stale_after=STALE_AFTER):
+        """
+        Returns the path of the lock if we got the shard, or None if another
+        worker has it. Instead of removing stale locks, which could remove one
+        that another worker just created, every claim creates a new one.
+
+        The owner is written to a file of our own first, which is then linked
+        to the lock (atomic, even over NFS), so a lock always has an owner.
+        """
+        host, pid = socket.gethostname(), os.getpid()
+        owner = os.path.join(self.locks, f"{shard['name']}.{host}.{pid}.tmp")
+        with open(owner, 'w') as f:
+            json.dump({'host': host, 'pid': pid}, f)
+
+        try:
+            attempt = 0
+            while True:
+                path = os.path.join(self.locks,
+                                    f"{shard['name']}.{attempt}.lock")
+                try:
+                    os.link(owner, path)
+                except FileExistsError:
+                    if not lock_is_stale(path, stale_after):
+                        return None
+                    attempt += 1
+                    continue
+                return path
+        finally:
+            os.remove(owner)
+
+    def check(self, shard, lock, engine, stale_after=STALE_AFTER):
+        optimizer = self.optimizer(shard['parameter_set'])
+
+        # so that other workers know we're still working on it
+        stop = threading.Event()
+
+        def touch_lock():
+            while not stop.wait(stale_after / 10):
+                os.utime(lock)
+
+        thread = threading.Thread(target=touch_lock, daemon=True)
+        thread.start()
+        try:
+            sweep = optimizer.sweep(engine, count=self.manifest()['count'],
+                                    start_rank=shard['start_rank'],
+                                    end_rank=shard['end_rank'])
+        finally:
+            stop.set()
+            thread.join()
+
+        optimizer.store_partial_sweep(self.result_path(shard), sweep,
+                                      shard['start_rank'], shard['end_rank'])
+
+    def work(self, engine=SWEEP_ENGINE, stale_after=STALE_AFTER):
+        """
+        Checks shards until all of them are done. Returns how many of them
+        this worker checked.
+        """
+        checked = 0
+        while True:
+            remaining = [shard for shard in self.manifest()['shards']
+                         if not self.done(shard)]
+            if not remaining:
+                return checked
+
+            claimed_any = False
+            for shard in remaining:
+                lock = self.claim(shard, stale_after)
+                # it might have been finished since we looked
+                if lock is None or self.done(shard):
+                    continue
+
+                claimed_any = True
+                self.check(shard, lock, engine, stale_after)
+                checked += 1
+
+            # the others might still die, so wait for their locks to be stale
+            if not claimed_any:
+                time.sleep(min(stale_after / 10, 1))
+
+    def merge(self):
+        """
+        Returns (parameters, optimizer, merged SweepResult, names of the
+        missing shards) for every parameter set. The SweepResult is None if
+        none of its shards are done.
+        """
+        merged = []
+        for key, parameter_set in self.manifest()['parameter_sets'].items():
+            shards = [shard for shard in self.manifest()['shards']
+                      if shard['parameter_set'] == key]
+            optimizer = self.optimizer(key)
+            paths = [self.result_path(shard) for shard in shards
+                     if self.done(shard)]
+            missing = [shard['name'] for shard in shards
+                       if not self.done(shard)]
+
+            sweep = None
+            if paths:
+                sweep, _ = optimizer.merge_partial_sweeps(paths)
+            merged.append((parameter_set['parameters'], optimizer, sweep,
+                           missing))
+        return merged
+
+
+def lock_is_stale(path, stale_after):
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        return False  # it was only just created
+    if age > stale_after:
+        return True
+
+    try:
+        with open(path) as f:
+            owner = json.load(f)
+    except (OSError, ValueError):
+        return False  # e.g. written by an older version that wasn't done
+    if owner['host'] != socket.gethostname():
+        return False
+
+    try:
+        os.kill(owner['pid'], 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # it belongs to another user
+    return False
+
+
+def work_in_process(path, engine, stale_after):
+    return ShardDirectory(path).work(engine, stale_after)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+            description="Checks all permutations in shards, on any number of "
+                        "hosts sharing a directory.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    plan = subparsers.add_parser(
+            'plan', help="split the permutations into shards")
+    plan.add_argument('dir')
+    plan.add_argument(
+            '--grid', type=grid_parameter, action='append', default=[],
+            metavar='NAME=VALUES',
+            help="check all permutations for every combination of the given "
+                 "values, e.g. 'ZIPF_FACTOR=[0.4, 0.6, 0.8]'")
+    plan.add_argument(
+            '--shards', type=int, default=SHARDS_PER_PARAMETER_SET,
+            metavar='N',
+            help=f"how many shards to split the permutations of each "
+                 f"parameter set into (default: {SHARDS_PER_PARAMETER_SET})")
+
+    work = subparsers.add_parser(
+            'work', help="check shards until all of them are done")
+    work.add_argument('dir')
+    work.add_argument(
+            '--engine', choices=SWEEP_ENGINES, default=SWEEP_ENGINE,
+            help=f"how to check the permutations (default: {SWEEP_ENGINE})")
+    work.add_argument(
+            '--processes', type=int, default=1, metavar='N',
+            help="how many workers to run on this host (0 is one for every "
+                 "CPU)")
+    work.add_argument(
+            '--stale-after', type=float, default=STALE_AFTER,
+            metavar='SECONDS',
+            help=f"when the locks of workers on other hosts count as stale "
+                 f"(default: {STALE_AFTER})")
+
+    merge = subparsers.add_parser(
+            'merge', help="show the merged results of every parameter set")
+    merge.add_argument('dir')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    shard_directory = ShardDirectory(args.dir)
+
+    if args.command == 'plan':
+        grid = dict(args.grid)
+        parameter_sets, optimizers = grid_optimizers(configured_optimizer(),
+                                                     grid)
+        shard_directory.plan(optimizers, parameter_sets,
+                             count_to_collect(BEST_PERMUTATIONS_COUNT),
+                             args.shards)
+        n_shards = len(shard_directory.manifest()['shards'])
+        print(f"Wrote {n_shards} shards for {len(optimizers)} parameter "
+              f"sets to {shard_directory.manifest_path}.")
+
+    elif args.command == 'work':
+        processes = args.processes or os.cpu_count()
+        if processes == 1:
+            checked = shard_directory.work(args.engine, args.stale_after)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(processes) as executor:
+                checked = sum(executor.map(
+                        work_in_process, [args.dir] * processes,
+                        [args.engine] * processes,
+                        [args.stale_after] * processes))
+        print(f"Checked {checked} shards, all of them are done.")
+
+    else:
+        for parameters, optimizer, sweep, missing in shard_directory.merge():
+            text = ', '.join(f'{name} = {value}'
+                             for name, value in parameters.items())
+            text = text or "Configured parameters"
+            print(f"\n\n\n{text}\n{'=' * len(text)}")
+            if missing:
+                print(f"\n{len(missing)} shards are missing: "
+                      f"{', '.join(missing)}")
+            if sweep is None:
+                continue
+
+            print_sweep(optimizer, sweep)
+            if not missing and CACHE_DIR is not None:
+                optimizer.store_sweep(CACHE_DIR, sweep, CACHE_MAX_SIZE)
+
+
+if __name__ == '__main__':
+    main()